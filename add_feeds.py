@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+FBeed Bulk Import
+Adds feeds from OPML files, lists of FetchRSS URLs or RSS exports to config.yaml
+and backfills their posts into the accumulated feeds in one pass.
+"""
+
+import os
+import re
+import json
+import time
+import argparse
+import tempfile
+from datetime import datetime
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree import ElementTree as ET
+import yaml
+import fbeed
+import feed_status
+import fetchrss_parser
+import post_store
+import post_dedup
+import run_stats
+
+CONFIG_PATH = 'config.yaml'
+
+ATOM_ENTRY = '{http://www.w3.org/2005/Atom}entry'
+
+FEEDS_KEY_PATTERN = re.compile(r'^feeds:\s*(#.*)?$')
+FEED_ITEM_PATTERN = re.compile(r'^(\s*)- ')
+
+
+def add_candidate(candidates, fetchrss_url, tags=(), export=None):
+    """Add a feed to the batch; a URL listed twice keeps every tag and export it was given"""
+    candidate = candidates.setdefault(fetchrss_url, {'fetchrss_url': fetchrss_url, 'tags': [], 'exports': []})
+    for tag in tags:
+        if tag not in candidate['tags']:
+            candidate['tags'].append(tag)
+    if export and export not in candidate['exports']:
+        candidate['exports'].append(export)
+
+
+def scan_xml_head(path):
+    """Root tag of an XML file and the self link of the feed in it; (None, None) if it isn't XML"""
+    root_tag = self_link = None
+    try:
+        for _, elem in ET.iterparse(path, events=('start',)):
+            if root_tag is None:
+                root_tag = elem.tag
+                if root_tag == 'opml':
+                    break
+            elif elem.tag == fbeed.ATOM_LINK and elem.get('rel') == 'self':
+                self_link = elem.get('href')
+            elif elem.tag in ('item', ATOM_ENTRY):
+                break
+    except ET.ParseError:
+        pass
+    return root_tag, self_link
+
+
+def read_outlines(parent, folders, candidates):
+    """Feeds among an OPML element's outlines, tagged with their folders and categories"""
+    for outline in parent.findall('outline'):
+        url = outline.get('xmlUrl')
+        if url:
+            # OPML categories are comma-separated paths such as "/Travel/Japan"
+            categories = [part.strip('/').split('/')[-1]
+                          for part in (outline.get('category') or '').split(',') if part.strip('/ ')]
+            add_candidate(candidates, url.strip(), folders + categories)
+            continue
+        label = outline.get('title') or outline.get('text')
+        read_outlines(outline, folders + [label] if label else folders, candidates)
+
+
+def read_url_list(path, candidates):
+    """Feeds of a text file with one URL per line, each optionally followed by an RSS export to backfill"""
+    directory = os.path.dirname(path)
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            fields = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            export = os.path.join(directory, fields[1]) if len(fields) > 1 else None
+            add_candidate(candidates, fields[0], export=export)
+
+
+def read_sources(sources):
+    """Feeds to import from URLs and files given on the command line, and the sources that were unusable"""
+    candidates = {}
+    rejected = []
+    for source in sources:
+        if '://' in source:
+            add_candidate(candidates, source)
+            continue
+        if not os.path.isfile(source):
+            rejected.append((source, 'no such file'))
+            continue
+
+        root_tag, self_link = scan_xml_head(source)
+        if root_tag == 'opml':
+            for body in ET.parse(source).getroot().findall('body'):
+                read_outlines(body, [], candidates)
+        elif root_tag is None:
+            read_url_list(source, candidates)
+        elif self_link:
+            add_candidate(candidates, self_link, export=source)
+        else:
+            rejected.append((source, 'RSS export without a self link, list it after its FetchRSS URL in a URL file'))
+    return candidates, rejected
+
+
+def get_url_error(url):
+    """Why a feed URL can't be polled, or None"""
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.netloc:
+        return 'not an http(s) URL'
+    return None
+
+
+def parse_export(path):
+    """Parsed entries of an RSS export and an error message, one of them None"""
+    try:
+        with open(path, 'rb') as f:
+            feed = fetchrss_parser.parse(f.read())
+    except Exception as e:
+        return None, str(e)
+    if not feed['entries']:
+        return None, 'no items'
+    return feed, None
+
+
+def get_backfill_result(stored, feed_data):
+    """A fetch result that merges export entries into a feed already accumulated"""
+    # The stored validators stay, so the next scheduled fetch is still conditional
+    return {
+        'feed': {
+            'feed': {key: stored.get(key, '') for key in ('title', 'description', 'link')},
+            'entries': feed_data['entries'],
+        },
+        'not_modified': False,
+        'error': None,
+        'etag': stored.get('etag'),
+        'last_modified': stored.get('last_modified'),
+        'body_hash': stored.get('body_hash'),
+        'fetch_seconds': 0.0,
+        'parse_seconds': 0.0,
+        'bytes': 0,
+        'retry_after': None,
+    }
+
+
+def fetch_batch(urls, exports, settings):
+    """Fetch the feeds and parse the exports of a batch concurrently"""
+    max_workers = settings.get('max_concurrent_fetches', 8)
+    with fbeed.create_session(max_workers) as session, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        fetches = fbeed.submit_fetches(
+            executor, urls, settings.get('max_concurrent_per_host', 4), {}, session,
+            settings.get('max_retries', 2), settings.get('retry_backoff_seconds', 2))
+        parses = [executor.submit(parse_export, path) for path in exports]
+        results = {url: future.result() for url, future in zip(urls, fetches)}
+        parsed = {path: future.result() for path, future in zip(exports, parses)}
+    return results, parsed
+
+
+def prepare_batch(candidates, metadata, configured, results, parsed, rejected):
+    """Turn fetched candidates into the feeds to import, dropping the ones that failed validation"""
+    accepted = []
+    for url, candidate in candidates.items():
+        feed_data = {'entries': []}
+        for path in candidate['exports']:
+            export, error = parsed[path]
+            if error:
+                rejected.append((path, error))
+            else:
+                feed_data['entries'].extend(export['entries'])
+
+        stored = fbeed.find_feed_metadata(metadata, url)
+        if stored and stored.get('slug'):
+            # Already accumulated: only its exports are new
+            if url in configured and not feed_data['entries']:
+                print(f"  ⏭️  Already in {CONFIG_PATH}: {url}")
+                continue
+            candidate['slug'] = stored['slug']
+            candidate['title'] = stored.get('title')
+            candidate['result'] = get_backfill_result(stored, feed_data) if feed_data['entries'] else None
+        else:
+            result = results[url]
+            if result['error'] or not result['feed']:
+                rejected.append((url, result['error'] or 'Empty feed'))
+                continue
+            # Fetched entries go first, so the live copy of a post wins over an exported one
+            entries = result['feed']['entries'] + feed_data['entries']
+            if not entries:
+                rejected.append((url, 'Empty feed'))
+                continue
+            candidate['title'] = result['feed']['feed'].get('title', 'Untitled Feed')
+            candidate['result'] = dict(result, feed=dict(result['feed'], entries=entries))
+        accepted.append(candidate)
+    return accepted
+
+
+def assign_slugs(accepted, metadata):
+    """Give each new feed a slug, resolving collisions the same way whatever order the feeds came in"""
+    slugs = fbeed.get_feed_slugs(metadata)
+    new = [candidate for candidate in accepted if 'slug' not in candidate]
+    for candidate in sorted(new, key=lambda candidate: candidate['fetchrss_url']):
+        slug = fbeed.resolve_slug(candidate['fetchrss_url'], candidate['title'], slugs)
+        slugs[candidate['fetchrss_url']] = candidate['slug'] = slug
+        # A slug that isn't its title's own is pinned in config.yaml, so scheduled runs keep it
+        candidate['pinned'] = slug != fbeed.generate_slug(candidate['title'])
+        if candidate['pinned']:
+            print(f"  🔀 {candidate['title']}: slug taken, using {slug}")
+
+
+def format_config_entry(candidate, indent):
+    """config.yaml lines of an imported feed"""
+    # JSON strings are valid double-quoted YAML scalars, like the URLs already in the file
+    lines = [f"{indent}- fetchrss_url: {json.dumps(candidate['fetchrss_url'], ensure_ascii=False)}\n"]
+    if candidate.get('pinned'):
+        lines.append(f"{indent}  slug: {json.dumps(candidate['slug'], ensure_ascii=False)}\n")
+    if candidate['tags']:
+        lines.append(f"{indent}  tags: {json.dumps(candidate['tags'], ensure_ascii=False)}\n")
+    return lines
+
+
+def add_config_feeds(candidates):
+    """Append feeds to the feeds list of config.yaml, leaving the rest of the file as written; return the new config"""
+    with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+        old_config = yaml.safe_load(''.join(lines))
+
+    start = next((i for i, line in enumerate(lines) if FEEDS_KEY_PATTERN.match(line)), None)
+    if start is None:
+        raise SystemExit(f"❌ No 'feeds:' list in {CONFIG_PATH} to add feeds to")
+
+    # The list runs until the next top-level key; new entries go after its last item
+    end = start + 1
+    indent = None
+    for i in range(start + 1, len(lines)):
+        line = lines[i]
+        if line.strip() and not line[0].isspace() and not line.startswith(('-', '#')):
+            break
+        if line.strip() and not line.lstrip().startswith('#'):
+            end = i + 1
+        match = FEED_ITEM_PATTERN.match(line)
+        if match and indent is None:
+            indent = match.group(1)
+    indent = '  ' if indent is None else indent
+    if not lines[end - 1].endswith('\n'):
+        lines[end - 1] += '\n'
+
+    entries = [line for candidate in candidates for line in format_config_entry(candidate, indent)]
+    text = ''.join(lines[:end] + entries + lines[end:])
+    config = yaml.safe_load(text)
+    urls = [feed_config['fetchrss_url'] for feed_config in config['feeds']]
+    expected = [feed_config['fetchrss_url'] for feed_config in old_config['feeds'] or []]
+    if urls != expected + [candidate['fetchrss_url'] for candidate in candidates]:
+        raise SystemExit(f"❌ Could not add feeds to {CONFIG_PATH} without changing its other entries")
+
+    fd, temp_path = tempfile.mkstemp(dir='.', prefix='.tmp-', suffix='.yaml')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, CONFIG_PATH)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return config
+
+
+def print_plan(accepted, configured):
+    """What an import would do"""
+    print("\n📋 Import plan:")
+    for candidate in accepted:
+        result = candidate['result']
+        items = len(result['feed']['entries']) if result else 0
+        action = 'backfill' if candidate['fetchrss_url'] in configured else 'add'
+        pinned = ' (pinned)' if candidate.get('pinned') else ''
+        print(f"  {action:<8} {candidate['slug']}{pinned}: {items} items  {candidate['fetchrss_url']}")
+
+
+def import_feeds(store, sources, dry_run=False):
+    """Validate, fetch and backfill a batch of feeds, then add them to config.yaml; return how many were imported"""
+    print("FBeed - Importing feeds...")
+    started_at = datetime.now(fbeed.HK_TZ).isoformat()
+    start = time.perf_counter()
+    config = fbeed.load_config()
+    settings = config.get('settings') or {}
+    metadata = feed_status.load_status()
+    configured = {feed_config['fetchrss_url'] for feed_config in config['feeds']}
+
+    candidates, rejected = read_sources(sources)
+    for url in list(candidates):
+        error = get_url_error(url)
+        if error:
+            rejected.append((url, error))
+            del candidates[url]
+    print(f"Read {len(candidates)} feeds from {len(sources)} sources")
+
+    # Only feeds that were never accumulated are fetched; the fetch is their validation
+    slugs = fbeed.get_feed_slugs(metadata)
+    new_urls = [url for url in candidates if not slugs.get(url)]
+    exports = sorted({path for candidate in candidates.values() for path in candidate['exports']})
+    results, parsed = fetch_batch(new_urls, exports, settings)
+    print(f"🌐 Fetched {len(new_urls)} feeds and read {len(exports)} exports in {time.perf_counter() - start:.1f}s")
+
+    accepted = prepare_batch(candidates, metadata, configured, results, parsed, rejected)
+    assign_slugs(accepted, metadata)
+    for source, error in rejected:
+        print(f"  ❌ {source}: {error}")
+
+    if dry_run:
+        print_plan(accepted, configured)
+        return 0
+    if not accepted:
+        print("\nNothing to import")
+        return 0
+
+    # Feeds are merged in the order they were listed, as run() merges them in config order
+    records = []
+    changed = False
+    for candidate in accepted:
+        if candidate['result'] is None:
+            continue
+        print(f"\nBackfilling: {candidate['fetchrss_url']}")
+        stats = run_stats.new_feed_record(candidate['fetchrss_url'])
+        records.append(stats)
+        changed |= fbeed.process_feed(candidate['fetchrss_url'], candidate['result'], metadata, store, settings,
+                                      stats, candidate['slug'])
+
+    added = [candidate for candidate in accepted if candidate['fetchrss_url'] not in configured]
+    if not added and not changed:
+        print("\n✅ No new feeds or posts, nothing written")
+        return 0
+
+    # The new feeds go into config.yaml before the status that lists them,
+    # so an interrupted import is picked up by the next scheduled run
+    if added:
+        config = add_config_feeds(added)
+        print(f"\n📝 Added {len(added)} feeds to {CONFIG_PATH}")
+
+    if post_dedup.update_signatures(store):
+        metadata['dedup'] = post_dedup.get_dedup_report(store)
+        post_dedup.print_report(metadata['dedup'])
+    changed_slugs = {stats['slug'] for stats in records if stats['items_added']}
+    fbeed.update_aggregates(store, config, metadata, changed_slugs, settings)
+    run_stats.print_summary(run_stats.summarise_run(started_at, time.perf_counter() - start, records))
+    feed_status.save_status(metadata)
+    fbeed.render_outputs(store, metadata)
+
+    posts = sum(stats['items_added'] for stats in records)
+    print(f"\n✅ Imported {len(accepted)} feeds with {posts} posts, {len(rejected)} sources rejected")
+    return len(accepted)
+
+
+def main():
+    """Main execution function"""
+    parser = argparse.ArgumentParser(description='FBeed - add feeds in bulk and backfill their posts')
+    parser.add_argument('sources', nargs='+', metavar='SOURCE',
+                        help='a FetchRSS URL, an OPML file, a file of URLs (one per line, optionally '
+                             'followed by an RSS export to backfill) or an RSS export with a self link')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='validate and fetch the feeds and print their slugs without writing anything')
+    args = parser.parse_args()
+
+    store = post_store.open_store()
+    try:
+        import_feeds(store, args.sources, args.dry_run)
+    finally:
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,467 @@
+#!/usr/bin/env python3
+"""
+FBeed Benchmark
+Runs fbeed.py and generate_index.py end to end against synthetic feeds served
+by a local FetchRSS stand-in, and records wall time and peak RSS per stage.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import hashlib
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.sax.saxutils import escape, quoteattr
+
+import yaml
+
+import fbeed
+import run_stats
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Runs a script and reports its own peak RSS. The child's rusage would also
+# count the benchmark process it was forked from, while VmHWM starts at exec.
+STAGE_RUNNER = """
+import os, sys, json, runpy, resource
+script, report_path = sys.argv[1], sys.argv[2]
+sys.argv = [script]
+sys.path[0] = os.path.dirname(script)
+try:
+    runpy.run_path(script, run_name='__main__')
+finally:
+    try:
+        with open('/proc/self/status') as f:
+            peak_kb = next(int(line.split()[1]) for line in f if line.startswith('VmHWM:'))
+    except OSError:
+        # ru_maxrss is in bytes on macOS
+        peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+    with open(report_path, 'w') as f:
+        json.dump({'peak_rss_kb': peak_kb}, f)
+"""
+
+# Newest accumulated post of every synthetic feed; later generations post after it
+BASE_TIMESTAMP = datetime(2025, 11, 1, tzinfo=timezone.utc).timestamp()
+POST_INTERVAL_SECONDS = 5 * 3600
+
+# Phrases in the mix of Cantonese, Mandarin and Japanese the real pages post
+CJK_PHRASES = [
+    '今日同大家分享一下最近嘅市場觀察', '美股科技業發展', '探討未來AI發展中最可靠的投資選擇',
+    '我相信都無咩人會無啦啦走去睇返', '大家先會明有冇泡', '每次寫文我都真係好小心寫',
+    '之後再解', '希望多啲人明', '投資研究資料', '幫助大家減少搜集資料及選股時間',
+    '本日のおすすめ', '新商品のお知らせです', 'ぜひチェックしてください', '期間限定キャンペーン',
+    '詳しくはプロフィールのリンクから', '香港天氣報告', '今晚八點直播', '多謝大家支持',
+    '點擊連結了解更多', '記得分享俾朋友', '週末活動預告', '最新消息', '限時優惠',
+]
+
+
+def make_text(rng, min_phrases, max_phrases):
+    """Random CJK text built from the phrase pool"""
+    count = rng.randint(min_phrases, max_phrases)
+    return '，'.join(rng.choice(CJK_PHRASES) for _ in range(count)) + '。'
+
+
+def make_media_url(rng, feed_index, number):
+    """An fbcdn-style image URL with the long query string FetchRSS passes through"""
+    token = hashlib.sha1(f'{feed_index}-{number}'.encode()).hexdigest()
+    return (f'https://scontent.xx.fbcdn.net/v/t39.30808-6/{feed_index}_{number}_{token[:12]}_n.jpg'
+            f'?_nc_cat={rng.randint(100, 120)}&ccb=1-7&_nc_sid=127cfc&_nc_ohc={token[12:32]}'
+            f'&_nc_ht=scontent.xx&oh=00_{token[:28]}&oe=691DF08C')
+
+
+def get_feed_title(feed_index):
+    """Channel title of a synthetic page"""
+    return f'測試專頁{feed_index:04d} on Facebook'
+
+
+def make_post(seed, feed_index, number):
+    """The post with sequence number `number` of a synthetic feed (higher is newer)"""
+    rng = random.Random(f'{seed}-{feed_index}-{number}')
+    page_id = 100000000000000 + feed_index
+    post_id = 1000000000000000 + number
+    pub_ts = BASE_TIMESTAMP + number * POST_INTERVAL_SECONDS
+
+    paragraphs = [make_text(rng, 3, 12) for _ in range(rng.randint(1, 6))]
+    has_media = rng.random() < 0.7
+    media_url = make_media_url(rng, feed_index, number) if has_media else None
+    if has_media:
+        paragraphs.append(f'<img src="{escape(media_url)}" />')
+    description = '<br />\n<br />\n'.join(paragraphs)
+    title = description[:120].split('<br />')[0]
+
+    return {
+        'guid': f'{page_id}_{post_id}',
+        'pub_ts': pub_ts,
+        'pub_date': format_datetime(datetime.fromtimestamp(pub_ts, timezone.utc)),
+        'title': title[:100] + '...' if len(title) > 100 else title,
+        'link': f'https://www.facebook.com/{page_id}/posts/{post_id}',
+        'description': description,
+        'creator': get_feed_title(feed_index)[:-len(' on Facebook')],
+        'has_media': has_media,
+        'media_url': media_url,
+        'media_medium': 'image' if has_media else None,
+    }
+
+
+def write_accumulated_feed(workdir, seed, feed_index, item_count):
+    """Write feeds/{slug}.xml as if item_count posts had already been accumulated"""
+    title = get_feed_title(feed_index)
+    header = {
+        'title': title,
+        'description': make_text(random.Random(f'{seed}-{feed_index}'), 2, 4),
+        'link': f'https://www.facebook.com/page{feed_index}',
+        'pub_date': format_datetime(datetime.fromtimestamp(BASE_TIMESTAMP, timezone.utc)),
+        'image_url': fbeed.FACEBOOK_ICON,
+        'image_title': title,
+        'image_link': f'https://www.facebook.com/page{feed_index}',
+        'generator': 'FBeed - Facebook Feed Accumulator',
+    }
+    posts = [make_post(seed, feed_index, number) for number in range(item_count - 1, -1, -1)]
+
+    uris = set()
+    if any(post['creator'] is not None for post in posts):
+        uris.add(fbeed.DC_CREATOR[1:].split('}')[0])
+    if any(post['has_media'] for post in posts):
+        uris.add(fbeed.MEDIA_CONTENT[1:].split('}')[0])
+
+    feed_path = os.path.join(workdir, 'feeds', f'{fbeed.generate_slug(title)}.xml')
+    fbeed.save_feed(
+        feed_path,
+        fbeed.build_channel_header(header),
+        (fbeed.build_item_element(post) for post in posts),
+        fbeed.get_namespaces(uris))
+    return os.path.getsize(feed_path)
+
+
+def render_upstream_feed(seed, feed_index, newest, count):
+    """A FetchRSS-shaped RSS response holding the `count` posts up to `newest`"""
+    title = get_feed_title(feed_index)
+    parts = [
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<rss xmlns:dc="http://purl.org/dc/elements/1.1/" '
+        'xmlns:media="http://search.yahoo.com/mrss/" version="2.0"><channel>',
+        f'<title>{escape(title)}</title>',
+        f'<link>https://www.facebook.com/page{feed_index}</link>',
+        f'<description>{escape(make_text(random.Random(f"{seed}-{feed_index}"), 2, 4))}</description>',
+        '<generator>FetchRSS</generator>',
+    ]
+    for number in range(newest, max(newest - count, -1), -1):
+        post = make_post(seed, feed_index, number)
+        parts.append(
+            f'<item><title>{escape(post["title"])}</title>'
+            f'<link>{escape(post["link"])}</link>'
+            f'<description>{escape(post["description"])}</description>'
+            f'<dc:creator>{escape(post["creator"])}</dc:creator>'
+            f'<pubDate>{post["pub_date"]}</pubDate>')
+        if post['has_media']:
+            parts.append(f'<media:content url={quoteattr(post["media_url"])} medium="image" />')
+        parts.append(f'<guid isPermaLink="false">{post["guid"]}</guid></item>')
+    parts.append('</channel></rss>')
+    return ''.join(parts).encode('utf-8')
+
+
+class FetchRSSStandIn:
+    """Local HTTP server imitating FetchRSS, with latency and injected errors"""
+
+    def __init__(self, seed, feed_count, item_count, upstream_items, new_items,
+                 latency=0.0, error_rate=0.0):
+        self.seed = seed
+        self.feed_count = feed_count
+        self.item_count = item_count
+        self.upstream_items = upstream_items
+        self.new_items = new_items
+        self.latency = latency
+        self.error_rate = error_rate
+        self.generation = 0
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.bodies = {}
+        self.counts = {'requests': 0, 'ok': 0, 'not_modified': 0, 'errors': 0, 'bytes': 0}
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.make_handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def get_feed_url(self, feed_index):
+        return f'http://127.0.0.1:{self.port}/feed/bench{feed_index:04d}.rss'
+
+    def get_body(self, feed_index):
+        """Response body of a feed at the current generation, cached"""
+        key = (feed_index, self.generation)
+        if key not in self.bodies:
+            newest = self.item_count - 1 + self.generation * self.new_items
+            self.bodies[key] = render_upstream_feed(self.seed, feed_index, newest, self.upstream_items)
+        return self.bodies[key]
+
+    def make_handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if stand_in.latency:
+                    time.sleep(stand_in.latency)
+                name = os.path.basename(self.path)
+
+                with stand_in.lock:
+                    stand_in.counts['requests'] += 1
+                    failed = stand_in.rng.random() < stand_in.error_rate
+                    if failed:
+                        stand_in.counts['errors'] += 1
+
+                if failed:
+                    self.send_response(stand_in.rng.choice((500, 502, 503)))
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                if not (name.startswith('bench') and name.endswith('.rss')):
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                with stand_in.lock:
+                    body = stand_in.get_body(int(name[5:-4]))
+                etag = '"%s"' % hashlib.md5(body).hexdigest()
+                if self.headers.get('If-None-Match') == etag:
+                    with stand_in.lock:
+                        stand_in.counts['not_modified'] += 1
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+
+                with stand_in.lock:
+                    stand_in.counts['ok'] += 1
+                    stand_in.counts['bytes'] += len(body)
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/rss+xml; charset=UTF-8')
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def take_counts(self):
+        """Request counters since the last call"""
+        with self.lock:
+            counts = self.counts
+            self.counts = dict.fromkeys(counts, 0)
+        return counts
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def prepare_workdir(workdir, seed, stand_in, feed_count, item_count):
+    """Lay out a repository copy with accumulated feeds and a config pointing at the stand-in"""
+    for name in ('template.html', 'feed-page.html', 'style.css', 'feed-style.xsl'):
+        shutil.copy(os.path.join(REPO_DIR, name), workdir)
+
+    with open(os.path.join(REPO_DIR, 'config.yaml'), 'r', encoding='utf-8') as f:
+        settings = (yaml.safe_load(f) or {}).get('settings') or {}
+    config = {
+        'feeds': [{'fetchrss_url': stand_in.get_feed_url(i)} for i in range(feed_count)],
+        'settings': settings,
+    }
+    with open(os.path.join(workdir, 'config.yaml'), 'w', encoding='utf-8') as f:
+        yaml.safe_dump(config, f, allow_unicode=True, sort_keys=False)
+
+    return sum(write_accumulated_feed(workdir, seed, i, item_count) for i in range(feed_count))
+
+
+def get_tree_size(path):
+    """Total size of the files under a directory"""
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+
+def run_stage(workdir, script, log_file):
+    """Run one of the repo scripts in the workdir, returning wall time and peak RSS"""
+    report_path = os.path.join(workdir, '.stage-report.json')
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-c', STAGE_RUNNER, os.path.join(REPO_DIR, script), report_path],
+        cwd=workdir, stdout=log_file, stderr=subprocess.STDOUT)
+    # wait4() gives the CPU time of this child alone
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    wall_seconds = time.perf_counter() - start
+
+    with open(report_path, 'r', encoding='utf-8') as f:
+        report = json.load(f)
+    os.remove(report_path)
+    return {
+        'wall_seconds': round(wall_seconds, 4),
+        'cpu_seconds': round(usage.ru_utime + usage.ru_stime, 4),
+        'peak_rss_kb': report['peak_rss_kb'],
+        'returncode': process.returncode,
+    }
+
+
+def run_case(args, feed_count, item_count):
+    """Benchmark one size: cold run (imports the XML), warm run with new posts, idle run, dashboard"""
+    workdir = tempfile.mkdtemp(prefix=f'fbeed-bench-{feed_count}x{item_count}-')
+    case = {'feeds': feed_count, 'items': item_count, 'stages': {}}
+    print(f"\n📏 {feed_count} feeds × {item_count} items ({workdir})")
+
+    stand_in = FetchRSSStandIn(
+        args.seed, feed_count, item_count, args.upstream_items, args.new_items,
+        args.latency, args.error_rate)
+    try:
+        with stand_in, open(os.path.join(workdir, 'bench.log'), 'w') as log_file:
+            start = time.perf_counter()
+            case['input_bytes'] = prepare_workdir(workdir, args.seed, stand_in, feed_count, item_count)
+            case['setup_seconds'] = round(time.perf_counter() - start, 4)
+
+            # generation 1 carries new posts for the cold and warm runs; the idle
+            # run sees the same responses again
+            stages = (
+                ('fetch_cold', 'fbeed.py', 1),
+                ('fetch_warm', 'fbeed.py', 2),
+                ('fetch_idle', 'fbeed.py', 2),
+                ('dashboard', 'generate_index.py', 2),
+            )
+            for name, script, generation in stages:
+                stand_in.generation = generation
+                log_file.write(f'\n===== {name} =====\n')
+                log_file.flush()
+                history_path = os.path.join(workdir, run_stats.RUN_STATS_PATH)
+                runs_before = len(run_stats.load_history(history_path)['runs'])
+                stage = run_stage(workdir, script, log_file)
+                if script == 'fbeed.py':
+                    stage['upstream'] = stand_in.take_counts()
+                    # Idle runs that write nothing leave no run-stats entry
+                    runs = run_stats.load_history(history_path)['runs']
+                    if len(runs) > runs_before:
+                        stage['feed_stages'] = runs[-1]['stages']
+                case['stages'][name] = stage
+                print(f"  {name:<12} {stage['wall_seconds']:>8.3f}s  "
+                      f"{stage['peak_rss_kb'] / 1024:>7.1f} MiB"
+                      + (f"  ❌ exit {stage['returncode']}" if stage['returncode'] else ''))
+
+        case['wall_seconds'] = round(sum(stage['wall_seconds'] for stage in case['stages'].values()), 4)
+        case['peak_rss_kb'] = max(stage['peak_rss_kb'] for stage in case['stages'].values())
+        case['output_bytes'] = get_tree_size(os.path.join(workdir, 'feeds'))
+    finally:
+        if args.keep:
+            case['workdir'] = workdir
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return case
+
+
+def get_git_revision():
+    """Commit of the code being benchmarked, if known"""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare_results(results, baseline_path):
+    """Print each stage's wall time relative to a previous results file"""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    baseline_cases = {(case['feeds'], case['items']): case for case in baseline['cases']}
+
+    print(f"\n📊 Compared with {baseline_path} ({baseline.get('revision') or 'unknown revision'})")
+    for case in results['cases']:
+        old_case = baseline_cases.get((case['feeds'], case['items']))
+        if old_case is None:
+            continue
+        for name, stage in case['stages'].items():
+            old_stage = old_case['stages'].get(name)
+            if not old_stage or not old_stage['wall_seconds']:
+                continue
+            ratio = stage['wall_seconds'] / old_stage['wall_seconds']
+            print(f"  {case['feeds']}×{case['items']} {name:<12} "
+                  f"{old_stage['wall_seconds']:>8.3f}s → {stage['wall_seconds']:>8.3f}s  ({ratio:.2f}×)")
+
+
+def parse_sizes(value):
+    """Comma-separated list of positive integers"""
+    sizes = [int(size) for size in value.split(',') if size.strip()]
+    if not sizes or min(sizes) <= 0:
+        raise argparse.ArgumentTypeError('expected positive integers, e.g. 10,50')
+    return sizes
+
+
+def main():
+    """Run the benchmark matrix and save the results"""
+    parser = argparse.ArgumentParser(description='FBeed - end-to-end benchmark')
+    parser.add_argument('--feeds', type=parse_sizes, default=[10, 43],
+                        help='comma-separated feed counts (default: 10,43)')
+    parser.add_argument('--items', type=parse_sizes, default=[100, 500],
+                        help='comma-separated accumulated items per feed (default: 100,500)')
+    parser.add_argument('--upstream-items', type=int, default=10,
+                        help='items in each FetchRSS response (default: 10)')
+    parser.add_argument('--new-items', type=int, default=2,
+                        help='new posts per feed between runs (default: 2)')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='seconds the stand-in waits before each response (default: 0.05)')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='fraction of requests answered with a 5xx (default: 0)')
+    parser.add_argument('--seed', type=int, default=0, help='seed for content and errors')
+    parser.add_argument('--output', default='benchmark-results.json',
+                        help='where to save the results (default: benchmark-results.json)')
+    parser.add_argument('--compare', metavar='BASELINE', help='previous results file to compare with')
+    parser.add_argument('--keep', action='store_true', help='keep the generated workdirs')
+    args = parser.parse_args()
+
+    print("FBeed - Benchmark")
+    results = {
+        'created': datetime.now(timezone.utc).isoformat(),
+        'revision': get_git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {
+            'upstream_items': args.upstream_items,
+            'new_items': args.new_items,
+            'latency': args.latency,
+            'error_rate': args.error_rate,
+            'seed': args.seed,
+        },
+        'cases': [
+            run_case(args, feed_count, item_count)
+            for feed_count in args.feeds
+            for item_count in args.items
+        ],
+    }
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\n✅ Results saved to {args.output}")
+
+    if args.compare:
+        compare_results(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
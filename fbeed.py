@@ -5,19 +5,84 @@ Fetches FetchRSS feeds, accumulates posts, and generates metadata.
 """
 
 import os
+import io
+import gzip
 import json
+import mimetypes
 import re
+import time
+import random
+import heapq
+import hashlib
+import signal
+import argparse
+import itertools
+import traceback
+import contextlib
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
+from urllib.parse import urlparse
 import yaml
 import requests
-import feedparser
+import fetchrss_parser
 from xml.etree import ElementTree as ET
 from xml.dom import minidom
+import post_store
+import run_stats
+import feed_status
+import post_dedup
+
+# Optional; without it feeds get no .br sidecar
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 # Hong Kong timezone (UTC+8)
 HK_TZ = timezone(timedelta(hours=8))
 
+# Public base URL of the GitHub Pages site
+SITE_URL = 'https://tommykhs.github.io/FBeed'
+
+# Namespace prefixes used when writing feeds
+NAMESPACES = {
+    'http://purl.org/dc/elements/1.1/': 'dc',
+    'http://search.yahoo.com/mrss/': 'media',
+    'http://www.w3.org/2005/Atom': 'atom',
+    'http://purl.org/syndication/history/1.0': 'fh',
+}
+
+ATOM_LINK = '{http://www.w3.org/2005/Atom}link'
+FH_ARCHIVE = '{http://purl.org/syndication/history/1.0}archive'
+DC_CREATOR = '{http://purl.org/dc/elements/1.1/}creator'
+MEDIA_CONTENT = '{http://search.yahoo.com/mrss/}content'
+
+# Facebook icon used as every feed's image
+FACEBOOK_ICON = 'data:image/svg+xml;base64,PHN2ZyB4bWxucz0naHR0cDovL3d3dy53My5vcmcvMjAwMC9zdmcnIHZpZXdCb3g9JzAgMCAyNCAyNCc+PHBhdGggZmlsbD0nIzE4NzdmMicgZD0nTTI0IDEyLjA3M2MwLTYuNjI3LTUuMzczLTEyLTEyLTEycy0xMiA1LjM3My0xMiAxMmMwIDUuOTkgNC4zODggMTAuOTU0IDEwLjEyNSAxMS44NTR2LTguMzg1SDcuMDc4di0zLjQ3aDMuMDQ3VjkuNDNjMC0zLjAwNyAxLjc5Mi00LjY2OSA0LjUzMy00LjY2OSAxLjMxMiAwIDIuNjg2LjIzNSAyLjY4Ni4yMzV2Mi45NTNIMTUuODNjLTEuNDkxIDAtMS45NTYuOTI1LTEuOTU2IDEuODc0djIuMjVoMy4zMjhsLS41MzIgMy40N2gtMi43OTZ2OC4zODVDMTkuNjEyIDIzLjAyNyAyNCAxOC4wNjIgMjQgMTIuMDczeicvPjwvc3ZnPg=='
+
+XSL_STYLESHEET_PI = '<?xml-stylesheet type="text/xsl" href="/FBeed/feed-style.xsl"?>'
+
+# cProfile output of a --profile run
+PROFILE_PATH = 'fbeed.pstats'
+
+# Responses worth retrying within a run
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Longest wait before an in-run retry; a longer Retry-After becomes the feed's backoff instead
+MAX_RETRY_WAIT_SECONDS = 60
+
+# Recent posts used to estimate how often a page posts
+CADENCE_SAMPLE_POSTS = 20
+
+# Combined feeds across all pages and per tag
+AGGREGATE_DIR = 'feeds/aggregate'
+
+# Partial status files written by `--shard i/N` runs, combined by `--merge-shards`
+SHARD_DIR = 'metadata/shards'
+
 
 def load_config():
     """Load configuration from config.yaml"""
@@ -39,71 +104,416 @@ def generate_slug(title):
     return slug
 
 
-def fetch_feed(url):
-    """Fetch and parse RSS feed from FetchRSS"""
+def get_feed_slugs(metadata):
+    """Map each feed URL to the slug its posts are accumulated under"""
+    return {url: feed.get('slug') for url, feed in metadata['feeds'].items()}
+
+
+def resolve_slug(fetchrss_url, title, slugs):
+    """Slug for a feed's title that no other feed's posts are accumulated under"""
+    # Two titles can give the same slug. A feed already accumulated under it
+    # keeps it, since renaming would move its files and URLs, and a newer feed
+    # gets a suffix from its URL instead. So which feed keeps the bare slug
+    # depends on which was stored first; only feeds that already share a slug
+    # (from before collisions were resolved) are split by URL, the first one
+    # keeping it. add_feeds.py resolves a batch in URL order, so a batch gets
+    # the same slugs whatever order its feeds were listed in.
+    slug = generate_slug(title) or 'feed'
+    owners = sorted(url for url, owned in slugs.items() if owned == slug)
+    if owners and owners[0] != fetchrss_url:
+        return f"{slug}-{hashlib.sha256(fetchrss_url.encode('utf-8')).hexdigest()[:6]}"
+    return slug
+
+
+def get_cached_validators(metadata):
+    """Map each feed URL to the ETag/Last-Modified/body hash from its last fetch"""
+    validators = {}
+    for feed in metadata['feeds'].values():
+        # Only trust the validators while the accumulated file still exists
+        if not os.path.exists(f"feeds/{feed.get('slug', '')}.xml"):
+            continue
+        validators[feed['fetchrss_url']] = {
+            'etag': feed.get('etag'),
+            'last_modified': feed.get('last_modified'),
+            'body_hash': feed.get('body_hash'),
+        }
+    return validators
+
+
+def create_session(pool_size):
+    """Shared HTTP session that keeps connections to each host alive across feeds"""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date), or None"""
+    if not value:
+        return None
+    
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    
+    try:
+        from email.utils import parsedate_to_datetime
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def get_retry_delay(attempt, backoff_seconds, retry_after=None):
+    """Jittered exponential backoff before a retry, never shorter than Retry-After"""
+    delay = backoff_seconds * 2 ** attempt
+    delay = random.uniform(delay / 2, delay)
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def get_fetch_error(url, error, retry_after, fetch_seconds):
+    """Result of a fetch that failed after all retries"""
+    print(f"Error fetching {url}: {error}")
+    return {
+        'feed': None,
+        'not_modified': False,
+        'error': error,
+        'retry_after': retry_after,
+        'fetch_seconds': fetch_seconds,
+        'parse_seconds': 0.0,
+        'bytes': 0,
+    }
+
+
+def fetch_feed(url, cached=None, session=None, max_retries=0, backoff_seconds=1.0):
+    """Fetch and parse RSS feed from FetchRSS, skipping the parse when unchanged"""
+    # Conditional request: a 304 or an identical body leaves 'feed' as None
+    cached = cached or {}
+    session = session or requests
+    headers = {}
+    if cached.get('etag'):
+        headers['If-None-Match'] = cached['etag']
+    if cached.get('last_modified'):
+        headers['If-Modified-Since'] = cached['last_modified']
+    
+    # Retry connection errors and 429/5xx responses with jittered exponential backoff
+    start = time.perf_counter()
+    attempt = 0
+    while True:
+        response = None
+        retry_after = None
+        try:
+            response = session.get(url, headers=headers, timeout=30)
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            error = f'HTTP {response.status_code}' if response.status_code in RETRY_STATUSES else None
+        except requests.RequestException as e:
+            error = str(e)
+        
+        if error is None:
+            break
+        if attempt >= max_retries or (retry_after or 0) > MAX_RETRY_WAIT_SECONDS:
+            return get_fetch_error(url, error, retry_after, time.perf_counter() - start)
+        
+        delay = get_retry_delay(attempt, backoff_seconds, retry_after)
+        print(f"Retrying {url} in {delay:.1f}s ({error})")
+        time.sleep(delay)
+        attempt += 1
+    fetch_seconds = time.perf_counter() - start
+    
     try:
-        response = requests.get(url, timeout=30)
+        if response.status_code == 304:
+            return {
+                'feed': None,
+                'not_modified': True,
+                'error': None,
+                'etag': response.headers.get('ETag', cached.get('etag')),
+                'last_modified': response.headers.get('Last-Modified', cached.get('last_modified')),
+                'body_hash': cached.get('body_hash'),
+                'fetch_seconds': fetch_seconds,
+                'parse_seconds': 0.0,
+                'bytes': 0,
+            }
+        
         response.raise_for_status()
-        feed = feedparser.parse(response.content)
-        return feed
+        body_hash = hashlib.sha256(response.content).hexdigest()
+        not_modified = body_hash == cached.get('body_hash')
+        start = time.perf_counter()
+        feed = None if not_modified else fetchrss_parser.parse(response.content)
+        return {
+            'feed': feed,
+            'not_modified': not_modified,
+            'error': None,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'body_hash': body_hash,
+            'fetch_seconds': fetch_seconds,
+            'parse_seconds': time.perf_counter() - start,
+            'bytes': len(response.content),
+        }
     except Exception as e:
-        print(f"Error fetching {url}: {e}")
-        return None
+        return get_fetch_error(url, str(e), None, fetch_seconds)
+
+
+def create_host_limits(urls, per_host_limit):
+    """Create one semaphore per upstream host to cap concurrent requests"""
+    hosts = {urlparse(url).netloc for url in urls}
+    return {host: threading.BoundedSemaphore(per_host_limit) for host in hosts}
+
+
+def fetch_feed_limited(url, cached, host_limits, session=None, max_retries=0, backoff_seconds=1.0):
+    """Fetch a feed while holding a concurrency slot for its host"""
+    # Retry waits keep the slot, so a struggling host isn't hit harder
+    with host_limits[urlparse(url).netloc]:
+        return fetch_feed(url, cached, session, max_retries, backoff_seconds)
+
+
+def submit_fetches(executor, urls, per_host_limit, validators, session=None,
+                   max_retries=0, backoff_seconds=1.0):
+    """Start fetching all feeds and return the futures in config order"""
+    host_limits = create_host_limits(urls, per_host_limit)
+    return [
+        executor.submit(fetch_feed_limited, url, validators.get(url), host_limits,
+                        session, max_retries, backoff_seconds)
+        for url in urls
+    ]
+
+
+def get_archive_dir(slug):
+    """Directory holding a feed's archive pages"""
+    return f'feeds/archive/{slug}'
 
 
-def load_existing_feed(feed_path):
-    """Load existing accumulated feed if it exists"""
+def get_archive_sort_key(page_path):
+    """Order archive pages named YYYY-MM-DD[-N].xml oldest first"""
+    name = os.path.splitext(os.path.basename(page_path))[0]
+    date, _, number = name[:10], name[10:11], name[11:]
+    return (date, int(number) if number.isdigit() else 1)
+
+
+def list_archive_pages(slug):
+    """Archive page paths of a feed on disk, oldest first"""
+    archive_dir = get_archive_dir(slug)
+    if not os.path.isdir(archive_dir):
+        return []
+    pages = [
+        f'{archive_dir}/{name}'
+        for name in os.listdir(archive_dir)
+        if name.endswith('.xml') and not name.startswith('.')
+    ]
+    return sorted(pages, key=get_archive_sort_key)
+
+
+def parse_item_element(item):
+    """Extract the stored fields of an accumulated <item> element"""
+    # findtext() gives '' for an empty element and None for a missing one,
+    # which is exactly the distinction the renderer needs
+    media = item.find(MEDIA_CONTENT)
+    pub_date = item.findtext('pubDate')
+    return {
+        'guid': item.findtext('guid') or '',
+        'pub_ts': get_sort_timestamp(pub_date),
+        'pub_date': pub_date,
+        'title': item.findtext('title'),
+        'link': item.findtext('link'),
+        'description': item.findtext('description'),
+        'creator': item.findtext(DC_CREATOR),
+        'has_media': media is not None,
+        'media_url': media.get('url') if media is not None else None,
+        'media_medium': media.get('medium') if media is not None else None,
+    }
+
+
+def scan_feed_xml(feed_path):
+    """Stream the items of an accumulated XML file, returning (header, posts)"""
+    posts = []
+    channel = None
+    for event, elem in ET.iterparse(feed_path, events=('start', 'end')):
+        if event == 'start' and elem.tag == 'channel':
+            channel = elem
+        elif event == 'end' and elem.tag == 'item':
+            posts.append(parse_item_element(elem))
+            channel.remove(elem)
+    
+    header = {
+        'title': channel.findtext('title'),
+        'description': channel.findtext('description'),
+        'link': channel.findtext('link'),
+        'pub_date': channel.findtext('pubDate'),
+        'image_url': channel.findtext('image/url'),
+        'image_title': channel.findtext('image/title'),
+        'image_link': channel.findtext('image/link'),
+        'generator': channel.findtext('generator'),
+    }
+    return header, posts
+
+
+def import_feed_xml(store, slug, feed_path):
+    """One-time import of an accumulated XML feed and its archive pages into the store"""
     if not os.path.exists(feed_path):
-        return None
+        return False
     
     try:
-        tree = ET.parse(feed_path)
-        root = tree.getroot()
+        header, posts = scan_feed_xml(feed_path)
+        post_store.add_feed(store, slug, header)
+        post_store.insert_posts(store, slug, posts)
         
-        # Extract existing GUIDs
-        existing_guids = set()
-        channel = root.find('channel')
-        if channel is not None:
-            for item in channel.findall('item'):
-                guid_elem = item.find('guid')
-                if guid_elem is not None and guid_elem.text:
-                    existing_guids.add(guid_elem.text)
-        
-        return {'tree': tree, 'root': root, 'guids': existing_guids}
+        for page_path in list_archive_pages(slug):
+            page_header, page_posts = scan_feed_xml(page_path)
+            post_store.insert_posts(store, slug, page_posts)
+            post_store.add_archive(
+                store, slug, page_path, page_header['pub_date'],
+                post_store.get_post_ids(store, slug, [post['guid'] for post in page_posts]))
     except Exception as e:
-        print(f"Error loading existing feed {feed_path}: {e}")
-        return None
+        print(f"Error importing existing feed {feed_path}: {e}")
+        store.rollback()
+        return False
+    
+    print(f"  Imported {post_store.count_posts(store, slug)} posts into the post store")
+    verify_import(store, slug, feed_path)
+    return True
+
+
+def verify_import(store, slug, feed_path):
+    """Warn when XML rendered from the store differs from the imported file"""
+    paths = [feed_path] + [row['path'] for row in post_store.list_archives(store, slug)]
+    for index, path in enumerate(paths):
+        tree = ET.parse(path)
+        channel = tree.getroot().find('channel')
+        expected = io.StringIO()
+        write_feed_document(
+            expected.write,
+            [child for child in channel if child.tag != 'item'],
+            channel.findall('item'),
+            get_tree_namespaces(tree.getroot()))
+        
+        if index == 0:
+            document = get_feed_document(store, slug)
+        else:
+            document = get_archive_document(store, slug, feed_path, index - 1)
+        rendered = io.StringIO()
+        write_feed_document(rendered.write, *document)
+        
+        if rendered.getvalue() != expected.getvalue():
+            print(f"  ⚠️  {path} renders differently from the post store")
+
+
+def create_new_feed(store, slug, feed_data):
+    """Register a new feed's channel header in the post store"""
+    post_store.add_feed(store, slug, {
+        'title': feed_data['feed'].get('title', 'Untitled Feed'),
+        'description': feed_data['feed'].get('description', ''),
+        'link': feed_data['feed'].get('link', ''),
+        'pub_date': datetime.now(HK_TZ).strftime('%a, %d %b %Y %H:%M:%S +0800'),
+        # Facebook icon as feed image
+        'image_url': FACEBOOK_ICON,
+        'image_title': feed_data['feed'].get('title', 'Untitled Feed'),
+        'image_link': feed_data['feed'].get('link', ''),
+        'generator': 'FBeed - Facebook Feed Accumulator',
+    })
 
 
-def create_new_feed(feed_data):
-    """Create a new RSS feed structure"""
-    # Register namespace prefixes - ElementTree will add xmlns when needed
-    ET.register_namespace('dc', 'http://purl.org/dc/elements/1.1/')
-    ET.register_namespace('media', 'http://search.yahoo.com/mrss/')
-    ET.register_namespace('atom', 'http://www.w3.org/2005/Atom')
+def build_channel_header(header, pub_date=None):
+    """Build the channel header elements in the order every feed uses"""
+    elements = []
+    for tag, column in (('title', 'title'), ('description', 'description'), ('link', 'link')):
+        if header[column] is not None:
+            elem = ET.Element(tag)
+            elem.text = header[column]
+            elements.append(elem)
     
-    # Create RSS element with ONLY version - no manual xmlns
-    rss = ET.Element('rss')
-    rss.set('version', '2.0')
+    pub_date = pub_date or header['pub_date']
+    if pub_date is not None:
+        elem = ET.Element('pubDate')
+        elem.text = pub_date
+        elements.append(elem)
     
-    channel = ET.SubElement(rss, 'channel')
+    if header['image_url'] is not None:
+        image = ET.Element('image')
+        ET.SubElement(image, 'url').text = header['image_url']
+        ET.SubElement(image, 'title').text = header['image_title']
+        ET.SubElement(image, 'link').text = header['image_link']
+        elements.append(image)
     
-    # Add channel metadata
-    ET.SubElement(channel, 'title').text = feed_data.feed.get('title', 'Untitled Feed')
-    ET.SubElement(channel, 'description').text = feed_data.feed.get('description', '')
-    ET.SubElement(channel, 'link').text = feed_data.feed.get('link', '')
-    ET.SubElement(channel, 'pubDate').text = datetime.now(HK_TZ).strftime('%a, %d %b %Y %H:%M:%S +0800')
+    if header['generator'] is not None:
+        elem = ET.Element('generator')
+        elem.text = header['generator']
+        elements.append(elem)
     
-    # Add Facebook icon as feed image
-    image = ET.SubElement(channel, 'image')
-    ET.SubElement(image, 'url').text = 'data:image/svg+xml;base64,PHN2ZyB4bWxucz0naHR0cDovL3d3dy53My5vcmcvMjAwMC9zdmcnIHZpZXdCb3g9JzAgMCAyNCAyNCc+PHBhdGggZmlsbD0nIzE4NzdmMicgZD0nTTI0IDEyLjA3M2MwLTYuNjI3LTUuMzczLTEyLTEyLTEycy0xMiA1LjM3My0xMiAxMmMwIDUuOTkgNC4zODggMTAuOTU0IDEwLjEyNSAxMS44NTR2LTguMzg1SDcuMDc4di0zLjQ3aDMuMDQ3VjkuNDNjMC0zLjAwNyAxLjc5Mi00LjY2OSA0LjUzMy00LjY2OSAxLjMxMiAwIDIuNjg2LjIzNSAyLjY4Ni4yMzV2Mi45NTNIMTUuODNjLTEuNDkxIDAtMS45NTYuOTI1LTEuOTU2IDEuODc0djIuMjVoMy4zMjhsLS41MzIgMy40N2gtMi43OTZ2OC4zODVDMTkuNjEyIDIzLjAyNyAyNCAxOC4wNjIgMjQgMTIuMDczeicvPjwvc3ZnPg=='
-    ET.SubElement(image, 'title').text = feed_data.feed.get('title', 'Untitled Feed')
-    ET.SubElement(image, 'link').text = feed_data.feed.get('link', '')
+    return elements
+
+
+def build_archive_link(rel, path):
+    """An RFC 5005 atom:link pointing at a page of the site"""
+    link = ET.Element(ATOM_LINK)
+    link.set('rel', rel)
+    link.set('href', f'{SITE_URL}/{path}')
+    return link
+
+
+def build_item_element(post):
+    """Build an <item> element from a stored post"""
+    item = ET.Element('item')
+    
+    for tag, column in (('title', 'title'), ('link', 'link'), ('description', 'description'),
+                        (DC_CREATOR, 'creator'), ('pubDate', 'pub_date')):
+        if post[column] is not None:
+            ET.SubElement(item, tag).text = post[column]
     
-    # Add generator
-    ET.SubElement(channel, 'generator').text = 'FBeed - Facebook Feed Accumulator'
+    # Media content
+    if post['has_media']:
+        media_elem = ET.SubElement(item, MEDIA_CONTENT)
+        if post['media_url'] is not None:
+            media_elem.set('url', post['media_url'])
+        if post['media_medium'] is not None:
+            media_elem.set('medium', post['media_medium'])
     
-    return ET.ElementTree(rss)
+    # GUID
+    guid_elem = ET.SubElement(item, 'guid')
+    guid_elem.set('isPermaLink', 'false')
+    guid_elem.text = post['guid']
+    
+    return item
+
+
+def get_entry_post(entry):
+    """Convert a fetched entry into the fields stored for a post"""
+    # Description
+    if 'description' in entry:
+        description = entry['description']
+    elif 'summary' in entry:
+        description = entry['summary']
+    else:
+        description = None
+    
+    # PubDate
+    if 'published' in entry:
+        pub_date = entry['published']
+    elif 'updated' in entry:
+        pub_date = entry['updated']
+    else:
+        pub_date = None
+    
+    # Media content
+    media = entry['media_content'][0] if entry.get('media_content') else None
+    
+    return {
+        'guid': get_entry_guid(entry),
+        'pub_ts': get_sort_timestamp(pub_date),
+        'pub_date': pub_date,
+        'title': entry.get('title'),
+        'link': entry.get('link'),
+        'description': description,
+        'creator': entry.get('author'),
+        'has_media': media is not None,
+        'media_url': media.get('url') if media is not None else None,
+        'media_medium': media.get('medium') if media is not None else None,
+    }
 
 
 def parse_rfc822_date(date_str):
@@ -116,235 +526,1251 @@ def parse_rfc822_date(date_str):
         return datetime(1970, 1, 1, tzinfo=timezone.utc)
 
 
-def sort_feed_items(channel):
-    """Sort all items in the feed by pubDate (newest first)"""
-    # Get all item elements
-    items = channel.findall('item')
-    
-    if not items:
-        return
+def get_sort_timestamp(date_str):
+    """Epoch seconds used to order an item, with the 1970 fallback for bad dates"""
+    if not date_str:
+        return 0.0
+    pub_date = parse_rfc822_date(date_str)
+    if pub_date.tzinfo is None:
+        pub_date = pub_date.replace(tzinfo=timezone.utc)
+    return pub_date.timestamp()
+
+
+def get_entry_guid(entry):
+    """GUID used to deduplicate a fetched entry"""
+    return entry.get('id', entry.get('link', ''))
+
+
+def add_items_to_feed(store, slug, feed_data):
+    """Upsert new items from feed_data into the post store"""
+    posts = [get_entry_post(entry) for entry in feed_data['entries']]
+    new_items_count = post_store.insert_posts(store, slug, posts)
     
-    # Extract items with their pubDate for sorting
-    items_with_dates = []
-    for item in items:
-        pubdate_elem = item.find('pubDate')
-        if pubdate_elem is not None and pubdate_elem.text:
-            pub_date = parse_rfc822_date(pubdate_elem.text)
-        else:
-            pub_date = datetime(1970, 1, 1, tzinfo=timezone.utc)
-        items_with_dates.append((pub_date, item))
+    # Update channel pubDate only when the item set changed
+    if new_items_count:
+        post_store.set_feed_pub_date(store, slug, datetime.now(HK_TZ).strftime('%a, %d %b %Y %H:%M:%S +0800'))
     
-    # Sort by date (newest first)
-    items_with_dates.sort(key=lambda x: x[0], reverse=True)
+    return new_items_count
+
+
+def get_archive_date(timestamp):
+    """UTC date an archive page is named after"""
+    return datetime.fromtimestamp(max(timestamp, 0), timezone.utc).strftime('%Y-%m-%d')
+
+
+def get_new_archive_path(slug, newest_timestamp, taken_paths):
+    """Dated path for a new archive page, numbered if the date is taken"""
+    date = get_archive_date(newest_timestamp)
+    archive_dir = get_archive_dir(slug)
+    page_path = f'{archive_dir}/{date}.xml'
+    number = 2
+    while page_path in taken_paths or os.path.exists(page_path):
+        page_path = f'{archive_dir}/{date}-{number}.xml'
+        number += 1
+    return page_path
+
+
+def get_namespaces(uris):
+    """Namespace declarations for the given URIs"""
+    return {uri: NAMESPACES[uri] for uri in uris}
+
+
+def get_tree_namespaces(root):
+    """Namespace declarations needed by an element tree"""
+    uris = set()
+    for elem in root.iter():
+        for name in [elem.tag, *elem.keys()]:
+            if name.startswith('{'):
+                uris.add(name[1:].split('}', 1)[0])
+    return get_namespaces(uris)
+
+
+def get_post_namespaces(store, slug, archive_page=None):
+    """Namespace URIs used by the items of the head feed or an archive page"""
+    flags = post_store.get_namespace_flags(store, slug, archive_page)
+    uris = set()
+    if flags['creator']:
+        uris.add(DC_CREATOR[1:].split('}')[0])
+    if flags['media']:
+        uris.add(MEDIA_CONTENT[1:].split('}')[0])
+    return uris
+
+
+def get_feed_document(store, slug):
+    """Header, item stream and namespaces of a feed's head document"""
+    header = build_channel_header(post_store.get_feed_header(store, slug))
+    uris = get_post_namespaces(store, slug)
     
-    # Remove all items from channel
-    for item in items:
-        channel.remove(item)
+    archives = post_store.list_archives(store, slug)
+    if archives:
+        header.append(build_archive_link('prev-archive', archives[-1]['path']))
+        uris.add(ATOM_LINK[1:].split('}')[0])
     
-    # Re-add items in sorted order
-    for _, item in items_with_dates:
-        channel.append(item)
+    items = (build_item_element(post) for post in post_store.iter_posts(store, slug))
+    return header, items, get_namespaces(uris)
 
 
-def add_items_to_feed(tree, feed_data, existing_guids):
-    """Add new items from feed_data to the XML tree"""
-    root = tree.getroot()
-    channel = root.find('channel')
+def get_archive_document(store, slug, feed_path, position):
+    """Header, item stream and namespaces of an RFC 5005 archive page"""
+    archives = post_store.list_archives(store, slug)
+    page = archives[position]
     
-    new_items_count = 0
+    header = build_channel_header(post_store.get_feed_header(store, slug), page['pub_date'])
+    header.append(ET.Element(FH_ARCHIVE))
+    header.append(build_archive_link('current', feed_path))
+    if position > 0:
+        header.append(build_archive_link('prev-archive', archives[position - 1]['path']))
+    if position < len(archives) - 1:
+        header.append(build_archive_link('next-archive', archives[position + 1]['path']))
     
-    # Get all items from the fetched feed
-    for entry in feed_data.entries:
-        guid = entry.get('id', entry.get('link', ''))
-        
-        # Skip if already exists
-        if guid in existing_guids:
-            continue
-        
-        # Create new item element
-        item = ET.Element('item')
-        
-        # Title
-        if 'title' in entry:
-            ET.SubElement(item, 'title').text = entry.title
-        
-        # Link
-        if 'link' in entry:
-            ET.SubElement(item, 'link').text = entry.link
-        
-        # Description
-        if 'description' in entry:
-            desc = ET.SubElement(item, 'description')
-            desc.text = entry.description
-        elif 'summary' in entry:
-            desc = ET.SubElement(item, 'description')
-            desc.text = entry.summary
-        
-        # Author/Creator
-        if 'author' in entry:
-            ET.SubElement(item, '{http://purl.org/dc/elements/1.1/}creator').text = entry.author
-        
-        # PubDate
-        if 'published' in entry:
-            ET.SubElement(item, 'pubDate').text = entry.published
-        elif 'updated' in entry:
-            ET.SubElement(item, 'pubDate').text = entry.updated
-        
-        # Media content
-        if 'media_content' in entry and entry.media_content:
-            media = entry.media_content[0]
-            media_elem = ET.SubElement(item, '{http://search.yahoo.com/mrss/}content')
-            if 'url' in media:
-                media_elem.set('url', media['url'])
-            if 'medium' in media:
-                media_elem.set('medium', media['medium'])
+    uris = get_post_namespaces(store, slug, page['path'])
+    uris.update(name[1:].split('}')[0] for name in (ATOM_LINK, FH_ARCHIVE))
+    items = (build_item_element(post) for post in post_store.iter_posts(store, slug, page['path']))
+    return header, items, get_namespaces(uris)
+
+
+def archive_old_items(store, slug, feed_path, head_max_items, page_size):
+    """Move the oldest posts into full archive pages, returning how many moved"""
+    archived = 0
+    
+    # Only full pages are written, so an archive page never changes its items
+    while post_store.count_posts(store, slug, head_only=True) - head_max_items >= page_size:
+        posts = post_store.get_oldest_head_posts(store, slug, page_size)
+        archives = post_store.list_archives(store, slug)
+        page_path = get_new_archive_path(slug, posts[0]['pub_ts'], {page['path'] for page in archives})
+        pub_date = post_store.get_feed_header(store, slug)['pub_date']
+        post_store.add_archive(store, slug, page_path, pub_date, [post['id'] for post in posts])
         
-        # GUID
-        guid_elem = ET.SubElement(item, 'guid')
-        guid_elem.set('isPermaLink', 'false')
-        guid_elem.text = guid
+        position = len(archives)
+        save_feed(page_path, *get_archive_document(store, slug, feed_path, position))
+        # The previous page gains a next-archive link; its items stay put
+        if position > 0:
+            save_feed(archives[-1]['path'], *get_archive_document(store, slug, feed_path, position - 1))
         
-        # Add to channel (will be sorted later)
-        channel.append(item)
-        existing_guids.add(guid)
-        new_items_count += 1
+        archived += len(posts)
+        print(f"  🗄️  Archived {len(posts)} posts to {page_path}")
+    
+    return archived
+
+
+def get_archive_neighbours(paths):
+    """The (prev-archive, next-archive) paths of each page of an archive chain"""
+    return {
+        path: (paths[index - 1] if index else None, paths[index + 1] if index + 1 < len(paths) else None)
+        for index, path in enumerate(paths)
+    }
+
+
+def archive_backfilled_items(store, slug, feed_path, after_id, page_size):
+    """Move new posts older than the archived ones into archive pages of their own, returning how many moved"""
+    newest = post_store.get_newest_archived_timestamp(store, slug)
+    posts = post_store.get_backfilled_posts(store, slug, after_id or 0, newest) if newest else []
+    if not posts:
+        return 0
     
-    # Sort all items by pubDate (newest first)
-    sort_feed_items(channel)
+    # Left in the head they would sit between the newest posts and archives
+    # newer than them. The chain is ordered by the dates in the page names, so
+    # each post goes before the first page named after a later day; the new
+    # page is then named after a day that sorts into the same place
+    archives = post_store.list_archives(store, slug)
+    dates = [get_archive_sort_key(page['path'])[0] for page in archives]
+    gaps = {}
+    for post in posts:
+        date = get_archive_date(post['pub_ts'])
+        gap = next((index for index, page_date in enumerate(dates) if page_date > date), len(dates))
+        gaps.setdefault(gap, []).append(post)
     
-    # Update channel pubDate
-    pubdate_elem = channel.find('pubDate')
-    if pubdate_elem is not None:
-        pubdate_elem.text = datetime.now(HK_TZ).strftime('%a, %d %b %Y %H:%M:%S +0800')
+    taken_paths = {page['path'] for page in archives}
+    pub_date = post_store.get_feed_header(store, slug)['pub_date']
+    for gap_posts in gaps.values():
+        for start in range(0, len(gap_posts), page_size):
+            page_posts = gap_posts[start:start + page_size]
+            page_path = get_new_archive_path(slug, page_posts[-1]['pub_ts'], taken_paths)
+            taken_paths.add(page_path)
+            post_store.add_archive(store, slug, page_path, pub_date, [post['id'] for post in page_posts])
+            print(f"  🗄️  Archived {len(page_posts)} backfilled posts to {page_path}")
     
-    return new_items_count
+    # Positions follow the page names, as list_archive_pages() does when the
+    # store is imported again; only pages whose links changed are written
+    old_links = get_archive_neighbours([page['path'] for page in archives])
+    paths = sorted(taken_paths, key=get_archive_sort_key)
+    post_store.set_archive_order(store, slug, paths)
+    for position, (path, links) in enumerate(get_archive_neighbours(paths).items()):
+        if old_links.get(path) != links:
+            save_feed(path, *get_archive_document(store, slug, feed_path, position))
+    
+    return len(posts)
+
+
+def escape_xml_text(text):
+    """Escape character data the same way ElementTree does"""
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def escape_xml_attrib(value):
+    """Escape an attribute value the same way ElementTree does"""
+    value = escape_xml_text(value).replace('"', '&quot;')
+    return value.replace('\r', '&#13;').replace('\n', '&#10;').replace('\t', '&#09;')
+
+
+def get_qname(name):
+    """Prefixed form of a {uri}local tag or attribute name"""
+    if name.startswith('{'):
+        uri, local = name[1:].split('}', 1)
+        return f'{NAMESPACES[uri]}:{local}'
+    return name
+
+
+def write_element(write, elem):
+    """Serialize an element piece by piece, matching ET.tostring() output"""
+    tag = get_qname(elem.tag)
+    write('<' + tag)
+    for key, value in elem.items():
+        write(f' {get_qname(key)}="{escape_xml_attrib(value)}"')
+    
+    if elem.text or len(elem):
+        write('>')
+        if elem.text:
+            write(escape_xml_text(elem.text))
+        for child in elem:
+            write_element(write, child)
+        write('</' + tag + '>')
+    else:
+        write(' />')
+    
+    if elem.tail:
+        write(escape_xml_text(elem.tail))
+
+
+def write_feed_document(write, header, items, namespaces):
+    """Write an RSS document from channel header elements and an item stream"""
+    write("<?xml version='1.0' encoding='utf-8'?>\n")
+    write(XSL_STYLESHEET_PI + '\n')
+    write('<rss')
+    for uri, prefix in sorted(namespaces.items(), key=lambda x: x[1]):
+        write(f' xmlns:{prefix}="{escape_xml_attrib(uri)}"')
+    write(' version="2.0"><channel>')
+    for elem in header:
+        write_element(write, elem)
+    for item in items:
+        write_element(write, item)
+    write('</channel></rss>')
+
+
+def get_json_feed_path(feed_path):
+    """JSON Feed written alongside an RSS document"""
+    return os.path.splitext(feed_path)[0] + '.json'
 
 
-def prettify_xml(elem):
-    """Return a pretty-printed XML string with XSL stylesheet reference"""
-    rough_string = ET.tostring(elem, encoding='utf-8', xml_declaration=True)
-    xml_str = rough_string.decode('utf-8')
+def get_sidecar_paths(feed_path):
+    """Files written alongside an RSS document, whether or not brotli is installed"""
+    return [f'{feed_path}.gz', f'{feed_path}.br', get_json_feed_path(feed_path)]
+
+
+def get_json_date(pub_date):
+    """RFC 3339 date of an RFC 822 pubDate, or None if it doesn't parse"""
+    from email.utils import parsedate_to_datetime
+    try:
+        date = parsedate_to_datetime(pub_date)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date.isoformat()
+
+
+def build_json_item(item):
+    """JSON Feed item of an <item> element"""
+    json_item = {'id': item.findtext('guid') or item.findtext('link') or ''}
+    for key, tag in (('url', 'link'), ('title', 'title'), ('content_html', 'description')):
+        if item.findtext(tag) is not None:
+            json_item[key] = item.findtext(tag)
     
-    # Add XSL stylesheet processing instruction after XML declaration
-    xml_lines = xml_str.split('\n')
-    if xml_lines[0].startswith('<?xml'):
-        xml_lines.insert(1, '<?xml-stylesheet type="text/xsl" href="/FBeed/feed-style.xsl"?>')
-        xml_str = '\n'.join(xml_lines)
+    if item.findtext('pubDate'):
+        date_published = get_json_date(item.findtext('pubDate'))
+        if date_published:
+            json_item['date_published'] = date_published
+    if item.findtext(DC_CREATOR):
+        json_item['authors'] = [{'name': item.findtext(DC_CREATOR)}]
     
-    return xml_str
+    # Images are the item's image; other media become attachments
+    media = item.find(MEDIA_CONTENT)
+    if media is not None and media.get('url'):
+        medium = media.get('medium')
+        if medium in (None, 'image'):
+            json_item['image'] = media.get('url')
+        else:
+            mime_type = mimetypes.guess_type(urlparse(media.get('url')).path)[0]
+            json_item['attachments'] = [{'url': media.get('url'), 'mime_type': mime_type or f'{medium}/*'}]
+    return json_item
+
+
+def build_json_feed(feed_path, header):
+    """JSON Feed 1.1 document of an RSS document's channel header, without its items"""
+    document = {'version': 'https://jsonfeed.org/version/1.1'}
+    for elem in header:
+        if elem.tag == 'title':
+            document['title'] = elem.text or ''
+        elif elem.tag == 'link' and elem.text:
+            document['home_page_url'] = elem.text
+        elif elem.tag == 'description' and elem.text:
+            document['description'] = elem.text
+        elif elem.tag == ATOM_LINK and elem.get('rel') == 'prev-archive':
+            # Older posts continue in the archive page's own JSON Feed
+            document['next_url'] = get_json_feed_path(elem.get('href'))
+    document['feed_url'] = f'{SITE_URL}/{get_json_feed_path(feed_path)}'
+    return document
+
 
+def encode_json(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
 
-def save_feed(tree, feed_path):
-    """Save the feed to file"""
+
+def save_feed(feed_path, header, items, namespaces):
+    """Stream the feed and its sidecars to temp files and atomically swap them into place"""
     # Create directory if it doesn't exist
-    os.makedirs(os.path.dirname(feed_path), exist_ok=True)
+    feed_dir = os.path.dirname(feed_path)
+    os.makedirs(feed_dir, exist_ok=True)
     
-    # Pretty print and save
-    xml_string = prettify_xml(tree.getroot())
+    # The RSS is serialized once; each chunk goes to the XML file and the
+    # compressors, and each item is also turned into a JSON Feed item
+    targets = {feed_path: None, f'{feed_path}.gz': None, get_json_feed_path(feed_path): None}
+    if brotli:
+        targets[f'{feed_path}.br'] = None
+    try:
+        for path in targets:
+            fd, targets[path] = tempfile.mkstemp(dir=feed_dir, prefix='.tmp-', suffix=os.path.splitext(path)[1])
+            os.close(fd)
+        
+        with contextlib.ExitStack() as stack:
+            f = stack.enter_context(open(targets[feed_path], 'wb'))
+            # No file name or time in the gzip header, so the same feed always
+            # compresses to the same bytes whatever the temp file was called
+            gz_file = stack.enter_context(open(targets[f'{feed_path}.gz'], 'wb'))
+            gz = stack.enter_context(gzip.GzipFile('', 'wb', compresslevel=6, fileobj=gz_file, mtime=0))
+            sinks = [f.write, gz.write]
+            if brotli:
+                br = stack.enter_context(open(targets[f'{feed_path}.br'], 'wb'))
+                # Quality 9 compresses nearly as well as 11 at a fraction of the time
+                compressor = brotli.Compressor(quality=9)
+                sinks.append(lambda data: br.write(compressor.process(data)))
+            
+            # The JSON Feed is streamed as well: its header, then each item
+            # as the RSS item goes by, so neither keeps every item in memory
+            json_file = stack.enter_context(open(targets[get_json_feed_path(feed_path)], 'w', encoding='utf-8'))
+            json_file.write(encode_json(build_json_feed(feed_path, header))[:-1] + ',"items":[')
+            
+            buffer = io.StringIO()
+            def flush():
+                data = buffer.getvalue().encode('utf-8')
+                buffer.seek(0)
+                buffer.truncate()
+                for sink in sinks:
+                    sink(data)
+            
+            # The buffer is drained between items rather than on every write
+            def stream_items():
+                for index, item in enumerate(items):
+                    json_file.write((',' if index else '') + encode_json(build_json_item(item)))
+                    yield item
+                    if buffer.tell() >= 65536:
+                        flush()
+            
+            write_feed_document(buffer.write, header, stream_items(), namespaces)
+            flush()
+            json_file.write(']}')
+            if brotli:
+                br.write(compressor.finish())
+            f.flush()
+            os.fsync(f.fileno())
+        
+        # The RSS goes last, so a complete XML file always has its sidecars beside it
+        for path in sorted(targets, key=lambda path: path == feed_path):
+            os.chmod(targets[path], 0o644)
+            os.replace(targets[path], path)
+        if not brotli and os.path.exists(f'{feed_path}.br'):
+            # A stale .br would no longer match the feed
+            os.remove(f'{feed_path}.br')
+    except BaseException:
+        for temp_path in targets.values():
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
+        raise
+
+
+def render_feed(store, slug, feed_path):
+    """Render a feed's head document from the post store"""
+    save_feed(feed_path, *get_feed_document(store, slug))
+
+
+def get_aggregates(config, metadata):
+    """Title and member slugs of the all-feeds aggregate and each tag, keyed by name"""
+    slugs = get_feed_slugs(metadata)
+    aggregates = {'all': {'title': 'FBeed - All Feeds', 'members': []}}
+    for feed_config in config['feeds']:
+        # Feeds that were never fetched have nothing to contribute yet
+        slug = slugs.get(feed_config['fetchrss_url'])
+        if not slug:
+            continue
+        tags = [str(tag) for tag in feed_config.get('tags') or []]
+        for name, tag in [('all', None)] + [(f'tags/{generate_slug(tag)}', tag) for tag in tags]:
+            aggregate = aggregates.setdefault(name, {'title': f'FBeed - {tag}', 'members': []})
+            if slug not in aggregate['members']:
+                aggregate['members'].append(slug)
+    return aggregates
+
+
+def get_aggregate_path(name):
+    """Output path of an aggregate feed"""
+    return f'{AGGREGATE_DIR}/{name}.xml'
+
+
+def iter_aggregate_posts(store, members, max_items):
+    """Newest posts across the member feeds, by a k-way merge of their sorted streams"""
+    # Each stream is an index-ordered cursor, so only the merge frontier and
+    # the posts taken are ever held in memory; ties keep member order
+    streams = [post_store.iter_all_posts(store, slug) for slug in members]
+    merged = heapq.merge(*streams, key=lambda post: -post['pub_ts'])
+    
+    # A repost is left out when the post it repeats is already in the feed
+    reposts = post_store.get_duplicate_ids(store, members)
+    return itertools.islice((post for post in merged if post['id'] not in reposts), max_items)
+
+
+def build_source_element(header, slug):
+    """RSS <source> naming the accumulated feed an aggregated item came from"""
+    source = ET.Element('source')
+    source.set('url', f'{SITE_URL}/feeds/{slug}.xml')
+    source.text = header['title']
+    return source
+
+
+def get_aggregate_document(store, aggregate, posts):
+    """Header, items and namespaces of an aggregate feed"""
+    headers = {slug: post_store.get_feed_header(store, slug) for slug in aggregate['members']}
+    header = build_channel_header({
+        'title': aggregate['title'],
+        'description': f"Latest posts from {len(aggregate['members'])} accumulated feeds",
+        'link': SITE_URL,
+        # The newest post's date keeps the document stable until its items change
+        'pub_date': posts[0]['pub_date'] if posts else None,
+        'image_url': FACEBOOK_ICON,
+        'image_title': aggregate['title'],
+        'image_link': SITE_URL,
+        'generator': 'FBeed - Facebook Feed Accumulator',
+    })
+    
+    items = []
+    uris = set()
+    for post in posts:
+        item = build_item_element(post)
+        item.insert(len(item) - 1, build_source_element(headers[post['feed']], post['feed']))
+        items.append(item)
+        if post['creator'] is not None:
+            uris.add(DC_CREATOR[1:].split('}')[0])
+        if post['has_media']:
+            uris.add(MEDIA_CONTENT[1:].split('}')[0])
+    return header, items, get_namespaces(uris)
+
+
+def update_aggregates(store, config, metadata, changed_slugs, settings):
+    """Rebuild the aggregates whose members changed; return True if any was written"""
+    max_items = settings.get('aggregate_max_items', 200)
+    stored = metadata.setdefault('aggregates', {})
+    written = False
+    
+    aggregates = get_aggregates(config, metadata)
+    for name, aggregate in aggregates.items():
+        path = get_aggregate_path(name)
+        previous = stored.get(name, {})
+        if (os.path.exists(path) and previous.get('members') == aggregate['members']
+                and not changed_slugs.intersection(aggregate['members'])):
+            continue
+        
+        posts = list(iter_aggregate_posts(store, aggregate['members'], max_items))
+        items_hash = get_items_hash(post['guid'] for post in posts)
+        if os.path.exists(path) and previous.get('items_hash') == items_hash:
+            # Same items; only a membership change is left to record
+            if previous.get('members') == aggregate['members']:
+                continue
+        else:
+            save_feed(path, *get_aggregate_document(store, aggregate, posts))
+            print(f"📚 Aggregated {len(posts)} posts from {len(aggregate['members'])} feeds into {path}")
+        stored[name] = {
+            'title': aggregate['title'],
+            'path': path,
+            'url': f'{SITE_URL}/{path}',
+            'members': aggregate['members'],
+            'total_posts': len(posts),
+            'items_hash': items_hash,
+        }
+        written = True
+    
+    # Tags no longer in config.yaml lose their feed
+    for name in [name for name in stored if name not in aggregates]:
+        for path in [stored[name]['path'], *get_sidecar_paths(stored[name]['path'])]:
+            if os.path.exists(path):
+                os.remove(path)
+        del stored[name]
+        written = True
     
-    with open(feed_path, 'w', encoding='utf-8') as f:
-        f.write(xml_string)
+    return written
+
+
+def get_latest_post_time(store, slug):
+    """ISO timestamp of the newest post in the head feed, as shown on the dashboard"""
+    post = post_store.get_latest_post(store, slug)
+    if post is None or not post['pub_date']:
+        return None
+    try:
+        from email.utils import parsedate_to_datetime
+        return parsedate_to_datetime(post['pub_date']).isoformat()
+    except Exception:
+        return None
+
+
+def find_feed_metadata(metadata, fetchrss_url):
+    """Return the metadata entry for a feed URL, or None"""
+    return metadata['feeds'].get(fetchrss_url)
+
+
+def get_items_hash(guids):
+    """Order-independent content hash of a feed's item set"""
+    digest = hashlib.sha256()
+    for guid in sorted(guids):
+        digest.update(guid.encode('utf-8') + b'\n')
+    return digest.hexdigest()
 
 
 def update_metadata(metadata, feed_info):
     """Update metadata with feed information"""
     # Find existing feed or create new entry
-    existing_feed = None
-    for feed in metadata.get('feeds', []):
-        if feed['fetchrss_url'] == feed_info['fetchrss_url']:
-            existing_feed = feed
-            break
+    existing_feed = find_feed_metadata(metadata, feed_info['fetchrss_url'])
     
     if existing_feed:
         # Update existing
         existing_feed.update(feed_info)
     else:
         # Add new
-        if 'feeds' not in metadata:
-            metadata['feeds'] = []
-        metadata['feeds'].append(feed_info)
+        metadata['feeds'][feed_info['fetchrss_url']] = feed_info
     
     metadata['last_run'] = datetime.now(HK_TZ).isoformat()
 
 
-def main():
-    """Main execution function"""
-    print("FBeed - Starting feed accumulation...")
+def has_new_validators(stored, result):
+    """Whether a fetch came back with an ETag, Last-Modified or body hash the metadata doesn't have yet"""
+    return any(stored.get(field) != result[field] for field in ('etag', 'last_modified', 'body_hash'))
+
+
+def has_failure_state(feed):
+    """Whether a metadata entry still records failed fetches"""
+    return bool(feed and feed.get('consecutive_failures'))
+
+
+def is_backing_off(feed, now):
+    """Whether a feed failed recently enough that it should not be fetched yet"""
+    backoff_until = feed.get('backoff_until') if feed else None
+    return bool(backoff_until) and datetime.fromisoformat(backoff_until) > now
+
+
+def get_poll_interval(store, slug, new_items_count, settings):
+    """Minutes between polls of a feed, learned from how often it posts"""
+    # Poll about twice per typical gap between posts. A run that found several
+    # new posts means the page is outpacing that, so poll proportionally faster.
+    # Intervals are whole multiples of the floor so they line up with runs.
+    floor = settings.get('min_poll_minutes', 60)
+    ceiling = settings.get('max_poll_minutes', 720)
+    timestamps = post_store.get_recent_timestamps(store, slug, CADENCE_SAMPLE_POSTS)
+    if len(timestamps) < 2:
+        return floor
     
-    # Load configuration
-    config = load_config()
+    gaps = sorted(newer - older for newer, older in zip(timestamps, timestamps[1:]))
+    median_gap_minutes = gaps[len(gaps) // 2] / 60
+    interval = median_gap_minutes / 2 / max(1, new_items_count)
+    slots = min(max(1, round(interval / floor)), max(1, ceiling // floor))
+    return slots * floor
+
+
+def get_poll_slot(now, floor):
+    """Index of the scheduled run `now` belongs to; a late start stays in its run's slot"""
+    # Cron runs never start early but are often late by more than half the
+    # floor, which rounding would count as the next run
+    return int(now.timestamp() // (floor * 60))
+
+
+def is_due(fetchrss_url, feed, slot, floor):
+    """Whether a feed's poll interval puts it in this run"""
+    # Stateless: a feed polled every k runs is due when (slot + phase) % k == 0,
+    # with a per-feed phase so slow feeds spread out over the runs. Nothing is
+    # written for feeds that are checked and unchanged.
+    interval = feed.get('poll_interval_minutes') if feed else None
+    if not interval:
+        return True
+    slots = max(1, interval // floor)
+    phase = int(hashlib.sha1(fetchrss_url.encode('utf-8')).hexdigest()[:8], 16)
+    return (slot + phase) % slots == 0
+
+
+def get_failure_info(fetchrss_url, stored, error, retry_after, settings):
+    """Metadata fields of a failed fetch, with exponential backoff between attempts"""
+    failures = (stored or {}).get('consecutive_failures', 0) + 1
+    base_seconds = settings.get('failure_backoff_minutes', 30) * 60
+    max_seconds = settings.get('max_failure_backoff_minutes', 1440) * 60
+    backoff = min(base_seconds * 2 ** (failures - 1), max_seconds)
+    if retry_after:
+        backoff = max(backoff, retry_after)
+    
+    now = datetime.now(HK_TZ)
+    # Occasional failures are a warning; a feed that keeps failing is an error
+    status = 'error' if failures >= settings.get('error_after_failures', 3) else 'warning'
+    return {
+        'fetchrss_url': fetchrss_url,
+        'status': status,
+        'new_posts_this_run': 0,
+        'consecutive_failures': failures,
+        'last_error': error,
+        'last_error_at': now.isoformat(),
+        'backoff_until': (now + timedelta(seconds=backoff)).isoformat(),
+    }
+
+
+def process_feed(fetchrss_url, result, metadata, store, settings=None, stats=None, slug=None):
+    """Merge a fetched feed into the post store and render it; return True if metadata changed"""
+    # With write_only_on_change, the feed file and its metadata entry are left
+    # alone unless the item set (tracked by items_hash) actually changed
+    settings = settings or {}
+    only_on_change = settings.get('write_only_on_change', False)
+    head_max_items = settings.get('head_max_items')
+    if stats is None:
+        stats = run_stats.new_feed_record(fetchrss_url)
+    
+    if result:
+        stats['stages']['fetch'] = result['fetch_seconds']
+        stats['stages']['parse'] = result['parse_seconds']
+        stats['bytes_fetched'] = result['bytes']
+    
+    stored = find_feed_metadata(metadata, fetchrss_url)
+    
+    # One-time import of feeds accumulated before the post store existed. It
+    # comes before the early returns, or a feed that keeps answering 304 (or
+    # failing) would never reach the store.
+    if stored and stored.get('slug') and not post_store.has_feed(store, stored['slug']):
+        with run_stats.timed(stats, 'load'):
+            if import_feed_xml(store, stored['slug'], f"feeds/{stored['slug']}.xml"):
+                store.commit()
+    
+    if result and result['not_modified']:
+        # Upstream unchanged: skip parsing, merging and re-serializing
+        print(f"  ⏭️  Not modified, skipping")
+        stats['outcome'] = 'not_modified'
+        # New validators are still saved, or the next run would send stale ones
+        # and download the whole feed again
+        if (only_on_change and not has_failure_state(stored)
+                and (not stored or ('poll_interval_minutes' in stored and not has_new_validators(stored, result)))):
+            return False
+        feed_info = {
+            'fetchrss_url': fetchrss_url,
+            'last_updated': datetime.now(HK_TZ).isoformat(),
+            'status': 'success',
+            'new_posts_this_run': 0,
+            'consecutive_failures': 0,
+            'backoff_until': None,
+            'etag': result['etag'],
+            'last_modified': result['last_modified'],
+            'body_hash': result['body_hash'],
+        }
+        if stored and post_store.has_feed(store, stored.get('slug', '')):
+            feed_info['poll_interval_minutes'] = get_poll_interval(store, stored['slug'], 0, settings)
+        update_metadata(metadata, feed_info)
+        return True
+    
+    feed_data = result['feed'] if result else None
+    if not feed_data or not feed_data['entries']:
+        error = result['error'] if result and result['error'] else 'Empty feed'
+        print(f"  ❌ Failed to fetch: {error}")
+        stats['outcome'] = 'error'
+        # Record the failure so the feed backs off and the dashboard shows it
+        update_metadata(metadata, get_failure_info(
+            fetchrss_url, stored, error, result['retry_after'] if result else None, settings))
+        return True
     
-    # Load or create metadata
-    metadata_path = 'metadata/feed-status.json'
-    if os.path.exists(metadata_path):
-        with open(metadata_path, 'r', encoding='utf-8') as f:
-            metadata = json.load(f)
+    # Extract metadata
+    feed_title = feed_data['feed'].get('title', 'Untitled Feed')
+    feed_description = feed_data['feed'].get('description', '')
+    feed_link = feed_data['feed'].get('link', '')
+    # A slug pinned in config.yaml wins over the one from the title
+    slug = slug or resolve_slug(fetchrss_url, feed_title, get_feed_slugs(metadata))
+    
+    print(f"  Feed: {feed_title}")
+    print(f"  Slug: {slug}")
+    stats['slug'] = slug
+    stats['items_fetched'] = len(feed_data['entries'])
+    
+    feed_info = {
+        'title': feed_title,
+        'slug': slug,
+        'fetchrss_url': fetchrss_url,
+        'accumulated_url': f'{SITE_URL}/feeds/{slug}.xml',
+        'description': feed_description,
+        'link': feed_link,
+        'last_updated': datetime.now(HK_TZ).isoformat(),
+        'status': 'success',
+        'consecutive_failures': 0,
+        'backoff_until': None,
+        'etag': result['etag'],
+        'last_modified': result['last_modified'],
+        'body_hash': result['body_hash']
+    }
+    
+    # One-time import of feeds accumulated before the post store existed
+    feed_path = f'feeds/{slug}.xml'
+    with run_stats.timed(stats, 'load'):
+        if not post_store.has_feed(store, slug) and not import_feed_xml(store, slug, feed_path):
+            create_new_feed(store, slug, feed_data)
+            print(f"  Creating new feed")
+    
+    # Upsert; the store's (feed, guid) key does the dedup
+    with run_stats.timed(stats, 'merge'):
+        last_id = post_store.get_max_post_id(store, slug)
+        new_items_count = add_items_to_feed(store, slug, feed_data)
+        guids = post_store.get_feed_guids(store, slug)
+        feed_info['total_posts'] = len(guids)
+        feed_info['new_posts_this_run'] = new_items_count
+        feed_info['items_hash'] = get_items_hash(guids)
+        feed_info['latest_post_time'] = get_latest_post_time(store, slug)
+        feed_info['poll_interval_minutes'] = get_poll_interval(store, slug, new_items_count, settings)
+    stats['items_added'] = new_items_count
+    
+    if new_items_count or not os.path.exists(feed_path):
+        print(f"  Added {new_items_count} new posts")
+        
+        with run_stats.timed(stats, 'write'):
+            # Backfilled posts older than the archives can't go in the head
+            archive_backfilled_items(store, slug, feed_path, last_id, settings.get('archive_page_size', 100))
+            # Keep the head bounded by moving the oldest posts into archive pages
+            if head_max_items:
+                archive_old_items(store, slug, feed_path, head_max_items, settings.get('archive_page_size', 100))
+            
+            render_feed(store, slug, feed_path)
+        stats['bytes_written'] = os.path.getsize(feed_path)
+        stats['items_written'] = post_store.count_posts(store, slug, head_only=True)
+        print(f"  ✅ Saved to {feed_path}")
     else:
-        metadata = {'feeds': [], 'last_run': None}
+        print(f"  No new posts ({len(guids)} accumulated)")
+        if (only_on_change and stored and stored.get('items_hash') == feed_info['items_hash']
+                and 'latest_post_time' in stored and not has_failure_state(stored)
+                and stored.get('poll_interval_minutes') == feed_info['poll_interval_minutes']
+                and not has_new_validators(stored, result)):
+            store.commit()
+            stats['outcome'] = 'unchanged'
+            return False
+    
+    with run_stats.timed(stats, 'write'):
+        store.commit()
+    stats['outcome'] = 'updated' if new_items_count else 'unchanged'
+    update_metadata(metadata, feed_info)
+    return True
+
+
+def import_all_feeds(store):
+    """Re-import every accumulated feeds/*.xml file into the post store"""
+    for feed_path in sorted(Path('feeds').glob('*.xml')):
+        slug = feed_path.stem
+        print(f"\nImporting: {feed_path}")
+        post_store.delete_feed(store, slug)
+        import_feed_xml(store, slug, feed_path.as_posix())
+        store.commit()
+
+
+def sync_feed_xml(store, slug, feed_path):
+    """Bring the store up to date with a feed another process wrote; return True if it changed"""
+    if not post_store.has_feed(store, slug):
+        return import_feed_xml(store, slug, feed_path)
+    
+    # Posts are only ever added and an archive page never loses one, so upserting
+    # keeps the row ids of stored posts and the search index stays incremental
+    header, posts = scan_feed_xml(feed_path)
+    post_store.add_feed(store, slug, header)
+    added = post_store.insert_posts(store, slug, posts)
+    archived = {row['path'] for row in post_store.list_archives(store, slug)}
+    for page_path in list_archive_pages(slug):
+        if page_path in archived:
+            continue
+        page_header, page_posts = scan_feed_xml(page_path)
+        added += post_store.insert_posts(store, slug, page_posts)
+        post_store.add_archive(
+            store, slug, page_path, page_header['pub_date'],
+            post_store.get_post_ids(store, slug, [post['guid'] for post in page_posts]))
+        archived.add(page_path)
+    # A backfilled page can sort before pages already stored
+    post_store.set_archive_order(store, slug, sorted(archived, key=get_archive_sort_key))
+    store.commit()
+    return bool(added)
+
+
+def parse_shard(value):
+    """Parse a --shard argument such as '2/4' into (2, 4)"""
+    match = re.fullmatch(r'(\d+)/(\d+)', value)
+    if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise argparse.ArgumentTypeError(f"expected i/N with 1 <= i <= N, got '{value}'")
+    return int(match.group(1)), int(match.group(2))
+
+
+def get_feed_shard(fetchrss_url, shard_count):
+    """Shard (1-based) a feed belongs to, the same on every machine and run"""
+    # sha256 rather than the sha1 polling phase, so a shard doesn't end up
+    # holding the feeds that are all due in the same runs
+    return int(hashlib.sha256(fetchrss_url.encode('utf-8')).hexdigest()[:8], 16) % shard_count + 1
+
+
+def get_shard_path(shard):
+    """Partial status file of one shard"""
+    index, count = shard
+    return f'{SHARD_DIR}/feed-status-{index}-of-{count}.json'
+
+
+def save_shard_status(shard, metadata, urls, started_at, duration, records, changed, changed_slugs):
+    """Write a shard's partial status: its feeds' metadata and run records"""
+    index, count = shard
+    path = get_shard_path(shard)
+    feed_status.save_status({
+        'shard': index,
+        'shards': count,
+        'started_at': started_at,
+        'duration': duration,
+        'changed': changed,
+        'changed_slugs': sorted(changed_slugs),
+        'last_run': metadata.get('last_run'),
+        'feeds': {url: metadata['feeds'][url] for url in urls if url in metadata['feeds']},
+        'records': records,
+    }, path)
+    print(f"\n✅ Shard {index}/{count} complete, status saved to {path}")
+
+
+def load_shard_statuses():
+    """Partial status files of the last sharded run, checked for overlaps"""
+    paths = sorted(Path(SHARD_DIR).glob('feed-status-*.json')) if os.path.isdir(SHARD_DIR) else []
+    partials = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            partials.append(json.load(f))
+    if not partials:
+        return []
+    
+    count = partials[0]['shards']
+    indexes = [partial['shard'] for partial in partials]
+    if any(partial['shards'] != count for partial in partials) or len(set(indexes)) != len(indexes):
+        raise SystemExit(f"❌ Shard files in {SHARD_DIR} come from different runs: {[p.name for p in paths]}")
+    for partial in partials:
+        for feed in partial['feeds']:
+            if get_feed_shard(feed['fetchrss_url'], count) != partial['shard']:
+                raise SystemExit(f"❌ Shard {partial['shard']}/{count} has a feed it doesn't own: {feed['fetchrss_url']}")
+    
+    missing = sorted(set(range(1, count + 1)) - set(indexes))
+    if missing:
+        print(f"⚠️  Shards {missing} of {count} did not finish, their feeds keep their previous status")
+    return sorted(partials, key=lambda partial: partial['shard'])
+
+
+def get_new_feed_urls(urls, pinned_slugs, metadata):
+    """The feeds that have no slug yet, from config.yaml or an earlier run"""
+    return [
+        url for url in urls
+        if not pinned_slugs.get(url) and not (find_feed_metadata(metadata, url) or {}).get('slug')
+    ]
+
+
+def process_new_feeds(store, urls, pinned_slugs, metadata, settings):
+    """Fetch and add the new feeds sharded runs left out; return their run records and whether any was written"""
+    max_workers = settings.get('max_concurrent_fetches', 8)
+    now = datetime.now(HK_TZ)
+    records = []
+    changed = False
+    with create_session(max_workers) as session, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        due_urls = [url for url in urls if not is_backing_off(find_feed_metadata(metadata, url), now)]
+        futures = dict(zip(due_urls, submit_fetches(
+            executor, due_urls, settings.get('max_concurrent_per_host', 4), {}, session,
+            settings.get('max_retries', 2), settings.get('retry_backoff_seconds', 2))))
+        for fetchrss_url in urls:
+            print(f"\nAdding: {fetchrss_url}")
+            stats = run_stats.new_feed_record(fetchrss_url)
+            records.append(stats)
+            if fetchrss_url not in futures:
+                stats['outcome'] = 'backoff'
+                print(f"  ⏸️  Backing off after failures until {metadata['feeds'][fetchrss_url]['backoff_until']}")
+                continue
+            changed |= process_feed(fetchrss_url, futures[fetchrss_url].result(), metadata, store, settings, stats,
+                                    pinned_slugs[fetchrss_url])
+    return records, changed
+
+
+def merge_shards(store):
+    """Combine the partial status files of a sharded run into feed-status.json"""
+    print("FBeed - Merging shard results...")
+    config = load_config()
+    settings = config.get('settings') or {}
+    partials = load_shard_statuses()
+    if not partials:
+        print(f"⚠️  No shard status files in {SHARD_DIR}, nothing to merge")
+        return
+    
+    # Shards own disjoint feeds, so their entries replace the previous ones
+    # without conflicts
+    metadata = feed_status.load_status()
+    for partial in partials:
+        for feed in partial['feeds']:
+            update_metadata(metadata, feed)
+    last_runs = [run for run in [metadata.get('last_run')] + [p['last_run'] for p in partials] if run]
+    metadata['last_run'] = max(last_runs) if last_runs else None
     
-    # Process each feed
+    # The merge job's checkout may have no store, or one missing feeds; every
+    # configured feed it lacks is imported from its XML, not only changed ones
+    changed_slugs = set()
+    slugs = get_feed_slugs(metadata)
     for feed_config in config['feeds']:
-        fetchrss_url = feed_config['fetchrss_url']
-        print(f"\nProcessing: {fetchrss_url}")
-        
-        # Fetch feed
-        feed_data = fetch_feed(fetchrss_url)
-        if not feed_data or not feed_data.entries:
-            print(f"  ❌ Failed to fetch or empty feed")
+        slug = slugs.get(feed_config['fetchrss_url'])
+        if slug and not post_store.count_posts(store, slug) and import_feed_xml(store, slug, f'feeds/{slug}.xml'):
+            store.commit()
+            changed_slugs.add(slug)
+    
+    # Shards on other machines only hand over their feed files; pick up their
+    # new posts so the combined feeds see them
+    for partial in partials:
+        changed_slugs.update(partial['changed_slugs'])
+    for slug in sorted(changed_slugs):
+        if sync_feed_xml(store, slug, f'feeds/{slug}.xml'):
+            print(f"  Synced {slug} into the post store")
+    
+    changed = any(partial['changed'] for partial in partials)
+    # Only here are every feed's slugs known, so new feeds are added now
+    pinned_slugs = {feed_config['fetchrss_url']: feed_config.get('slug') for feed_config in config['feeds']}
+    new_urls = get_new_feed_urls(list(pinned_slugs), pinned_slugs, metadata)
+    new_records = []
+    if new_urls:
+        new_records, new_changed = process_new_feeds(store, new_urls, pinned_slugs, metadata, settings)
+        changed |= new_changed
+        changed_slugs.update(stats['slug'] for stats in new_records if stats['items_added'])
+    # The file keeps config order whatever order shards finish in
+    order = {feed_config['fetchrss_url']: index for index, feed_config in enumerate(config['feeds'])}
+    metadata['feeds'] = dict(sorted(metadata['feeds'].items(), key=lambda item: order.get(item[0], len(order))))
+    
+    # Reposts are flagged before the combined feeds leave them out
+    if post_dedup.update_signatures(store):
+        metadata['dedup'] = post_dedup.get_dedup_report(store)
+        post_dedup.print_report(metadata['dedup'])
+    changed |= update_aggregates(store, config, metadata, changed_slugs, settings)
+    
+    records = sorted(
+        [record for partial in partials for record in partial['records']] + new_records,
+        key=lambda record: order.get(record['fetchrss_url'], len(order)))
+    run_record = run_stats.summarise_run(
+        min(partial['started_at'] for partial in partials),
+        max(partial['duration'] for partial in partials),
+        records)
+    run_stats.print_summary(run_record)
+    
+    if changed or not settings.get('write_only_on_change', False):
+        run_stats.append_run(run_record)
+        feed_status.save_status(metadata)
+        print(f"\n✅ Merged {len(partials)} shards into {feed_status.STATUS_PATH}")
+    else:
+        print(f"\n✅ No feed changed, nothing written")
+    
+    for partial in partials:
+        os.remove(get_shard_path((partial['shard'], partial['shards'])))
+
+
+def resume_journal(metadata, journal_path, header):
+    """Replay an interrupted run's checkpoints into metadata; return those to keep and the open journal"""
+    previous, checkpoints = feed_status.load_journal(journal_path)
+    for checkpoint in checkpoints:
+        if checkpoint['feed']:
+            metadata['feeds'][checkpoint['fetchrss_url']] = checkpoint['feed']
+            metadata['last_run'] = checkpoint['last_run']
+    
+    if previous == header:
+        if checkpoints:
+            print(f"↩️  Resuming an interrupted run, {len(checkpoints)} feeds already done")
+        return checkpoints, feed_status.open_journal(journal_path)
+    
+    # A run from an earlier window is not resumed, its feeds are due again;
+    # what it wrote is carried over so it still gets saved
+    carried = [dict(checkpoint, carried=True) for checkpoint in checkpoints if checkpoint['changed']]
+    journal = feed_status.open_journal(journal_path, header)
+    for checkpoint in carried:
+        feed_status.append_checkpoint(journal, checkpoint)
+    if carried:
+        print(f"↩️  Carrying over {len(carried)} feeds changed by an interrupted earlier run")
+    return carried, journal
+
+
+def run(store, fetch_all=False, shard=None, config=None, metadata=None, session=None):
+    """Fetch the configured feeds that are due and merge them into the store; return True if anything was written"""
+    print("FBeed - Starting feed accumulation...")
+    started_at = datetime.now(HK_TZ).isoformat()
+    start = time.perf_counter()
+    
+    # Load configuration and metadata, unless a daemon already holds them
+    if config is None:
+        config = load_config()
+    if metadata is None:
+        metadata = feed_status.load_status()
+    
+    # Fetch concurrently, but process results in config order so the
+    # saved feeds and metadata match a serial run
+    settings = config.get('settings') or {}
+    max_workers = settings.get('max_concurrent_fetches', 8)
+    per_host_limit = settings.get('max_concurrent_per_host', 4)
+    only_on_change = settings.get('write_only_on_change', False)
+    urls = [feed_config['fetchrss_url'] for feed_config in config['feeds']]
+    pinned_slugs = {feed_config['fetchrss_url']: feed_config.get('slug') for feed_config in config['feeds']}
+    if shard:
+        urls = [url for url in urls if get_feed_shard(url, shard[1]) == shard[0]]
+        print(f"Shard {shard[0]}/{shard[1]}: {len(urls)} of {len(config['feeds'])} feeds")
+        # A new feed's slug has to be checked against every other feed's,
+        # including new feeds of other shards, so --merge-shards adds it
+        new_urls = get_new_feed_urls(urls, pinned_slugs, metadata)
+        if new_urls:
+            urls = [url for url in urls if url not in new_urls]
+            print(f"Leaving {len(new_urls)} new feeds to --merge-shards")
+    
+    # Each processed feed is checkpointed to a journal. A run interrupted part-way
+    # is resumed by the next one in the same scheduled slot, which skips the
+    # feeds already done.
+    now = datetime.now(HK_TZ)
+    floor = settings.get('min_poll_minutes', 60)
+    slot = get_poll_slot(now, floor)
+    journal_path = feed_status.get_journal_path(get_shard_path(shard) if shard else feed_status.STATUS_PATH)
+    checkpoints, journal = resume_journal(
+        metadata, journal_path, {'window': slot, 'shard': list(shard) if shard else None})
+    done = {checkpoint['fetchrss_url']: checkpoint for checkpoint in checkpoints if not checkpoint.get('carried')}
+    
+    # Feeds that failed recently are left alone until their backoff expires, and
+    # with adaptive polling each feed is only fetched every few runs
+    adaptive = settings.get('adaptive_polling', False) and not fetch_all
+    skipped = {}
+    for url in urls:
+        if url in done:
             continue
+        feed = find_feed_metadata(metadata, url)
+        if is_backing_off(feed, now):
+            skipped[url] = ('backoff', f"⏸️  Backing off after failures until {feed['backoff_until']}")
+        elif adaptive and not is_due(url, feed, slot, floor):
+            skipped[url] = ('not_due', f"⏳ Not due, polled every {feed['poll_interval_minutes']} min")
+    due_urls = [url for url in urls if url not in skipped and url not in done]
+    
+    records = []
+    changed = any(checkpoint['changed'] for checkpoint in checkpoints)
+    # A daemon's session stays open between cycles, along with its connections
+    if session is None:
+        session = owned_session = create_session(max_workers)
+    else:
+        owned_session = contextlib.nullcontext()
+    with owned_session, ThreadPoolExecutor(max_workers=max_workers) as executor, journal:
+        futures = dict(zip(due_urls, submit_fetches(
+            executor, due_urls, per_host_limit, get_cached_validators(metadata), session,
+            settings.get('max_retries', 2), settings.get('retry_backoff_seconds', 2))))
+        for fetchrss_url in urls:
+            print(f"\nProcessing: {fetchrss_url}")
+            if fetchrss_url in done:
+                records.append(done[fetchrss_url]['stats'])
+                print(f"  ✔️  Already done by the interrupted run")
+                continue
+            stats = run_stats.new_feed_record(fetchrss_url)
+            records.append(stats)
+            if fetchrss_url in skipped:
+                stats['outcome'], message = skipped[fetchrss_url]
+                print(f"  {message}")
+                continue
+            feed_changed = process_feed(fetchrss_url, futures[fetchrss_url].result(), metadata, store, settings, stats,
+                                        pinned_slugs[fetchrss_url])
+            changed |= feed_changed
+            feed_status.append_checkpoint(journal, {
+                'fetchrss_url': fetchrss_url,
+                'feed': find_feed_metadata(metadata, fetchrss_url) if feed_changed else None,
+                'last_run': metadata.get('last_run'),
+                'changed': feed_changed,
+                'stats': stats,
+            })
+    
+    # Combined feeds only need rebuilding where a member gained posts
+    changed_slugs = {stats['slug'] for stats in records if stats['items_added']}
+    changed_slugs.update(
+        checkpoint['stats']['slug'] for checkpoint in checkpoints if checkpoint['stats']['items_added'])
+    
+    # Combined feeds and the run history need every shard, so --merge-shards does them
+    if shard:
+        duration = time.perf_counter() - start
+        run_stats.print_summary(run_stats.summarise_run(started_at, duration, records))
+        save_shard_status(shard, metadata, urls, started_at, duration, records, changed, changed_slugs)
+        feed_status.remove_journal(journal_path)
+        return changed
+    
+    # Reposts are flagged before the combined feeds leave them out
+    if post_dedup.update_signatures(store):
+        metadata['dedup'] = post_dedup.get_dedup_report(store)
+        post_dedup.print_report(metadata['dedup'])
+    changed |= update_aggregates(store, config, metadata, changed_slugs, settings)
+    
+    run_record = run_stats.summarise_run(started_at, time.perf_counter() - start, records)
+    run_stats.print_summary(run_record)
+    
+    if only_on_change and not changed:
+        feed_status.remove_journal(journal_path)
+        print(f"\n✅ No feed changed, nothing written")
+        return False
+    
+    # Stats are kept only for runs that write, so idle runs still leave the tree untouched
+    run_stats.append_run(run_record)
+    
+    # Save metadata; the journal goes only once everything it recorded is in the status file
+    feed_status.save_status(metadata)
+    feed_status.remove_journal(journal_path)
+    
+    print(f"\n✅ Feed accumulation complete!")
+    print(f"Metadata saved to {feed_status.STATUS_PATH}")
+    return True
+
+
+def profile_run(store, fetch_all=False, shard=None):
+    """Run under cProfile and tracemalloc, then print the hottest functions and allocation sites"""
+    import cProfile
+    import pstats
+    import tracemalloc
+    
+    # cProfile only sees the main thread; time spent fetching in the worker
+    # threads shows up as waiting on the futures (see the fetch stage instead)
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    profiler.enable()
+    try:
+        run(store, fetch_all, shard)
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
         
-        # Extract metadata
-        feed_title = feed_data.feed.get('title', 'Untitled Feed')
-        feed_description = feed_data.feed.get('description', '')
-        feed_link = feed_data.feed.get('link', '')
-        slug = generate_slug(feed_title)
-        
-        print(f"  Feed: {feed_title}")
-        print(f"  Slug: {slug}")
-        
-        # Load existing or create new feed
-        feed_path = f'feeds/{slug}.xml'
-        existing = load_existing_feed(feed_path)
+        profiler.dump_stats(PROFILE_PATH)
+        print(f"\n🔥 Hottest functions (full profile in {PROFILE_PATH}):")
+        pstats.Stats(profiler).strip_dirs().sort_stats('cumulative').print_stats(25)
         
-        if existing:
-            tree = existing['tree']
-            existing_guids = existing['guids']
-            print(f"  Loaded existing feed with {len(existing_guids)} posts")
-        else:
-            tree = create_new_feed(feed_data)
-            existing_guids = set()
-            print(f"  Creating new feed")
+        print(f"🧠 Peak traced memory: {peak / 1024 / 1024:.1f} MiB. Top allocation sites:")
+        for stat in snapshot.statistics('lineno')[:10]:
+            print(f"   {stat}")
+
+
+def get_next_cycle(now, interval_minutes):
+    """Start of the next scheduled cycle, on a multiple of the interval like the workflow's cron"""
+    interval = interval_minutes * 60
+    return (int(now // interval) + 1) * interval
+
+
+def render_outputs(store, metadata):
+    """Rebuild the feed pages, dashboard and search index in this process"""
+    # Imported here so plain runs don't pay for Jinja and pytz
+    import feed_pages
+    import generate_index
+    import search_index
+    
+    feed_pages.update_pages(store)
+    generate_index.generate_dashboard(metadata=dict(metadata, feeds=list(metadata['feeds'].values())))
+    search_index.update_index(store)
+
+
+def get_mtime(path):
+    """Modification time of a file in nanoseconds, or None if it doesn't exist"""
+    return os.stat(path).st_mtime_ns if os.path.exists(path) else None
+
+
+def run_daemon(store, fetch_all=False):
+    """Run fetch and render cycles on a schedule, keeping config, status and connections warm"""
+    stopping = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stopping.set())
+    
+    config = config_mtime = metadata = status_mtime = session = None
+    print(f"FBeed - Running as a daemon (pid {os.getpid()}), stop with Ctrl+C or SIGTERM")
+    while not stopping.is_set():
+        # config.yaml is reloaded only when it changes; a broken edit keeps the previous config
+        mtime = os.path.getmtime('config.yaml')
+        if mtime != config_mtime:
+            try:
+                new_config = load_config()
+                if not isinstance(new_config, dict) or not isinstance(new_config.get('feeds'), list):
+                    raise ValueError('no feeds list')
+            except (OSError, yaml.YAMLError, ValueError) as e:
+                if config is None:
+                    raise
+                print(f"⚠️  Keeping the previous config, config.yaml is invalid: {e}")
+            else:
+                if config is not None:
+                    print("🔄 Reloaded config.yaml")
+                config = new_config
+                if session is not None:
+                    session.close()
+                session = create_session((config.get('settings') or {}).get('max_concurrent_fetches', 8))
+            config_mtime = mtime
         
-        # Add new items
-        new_items_count = add_items_to_feed(tree, feed_data, existing_guids)
-        print(f"  Added {new_items_count} new posts")
+        # The status is reloaded when something other than this daemon wrote it
+        # since the last cycle, such as add_feeds.py or a manual edit, so its
+        # feeds aren't overwritten with the copy held in memory
+        if metadata is None or get_mtime(feed_status.STATUS_PATH) != status_mtime:
+            if metadata is not None:
+                print(f"🔄 Reloaded {feed_status.STATUS_PATH}")
+            metadata = feed_status.load_status()
         
-        # Save feed
-        save_feed(tree, feed_path)
-        print(f"  ✅ Saved to {feed_path}")
+        try:
+            if run(store, fetch_all, config=config, metadata=metadata, session=session):
+                render_outputs(store, metadata)
+        except Exception:
+            # The journal and files on disk are the record of what happened;
+            # start the next cycle from them
+            traceback.print_exc()
+            metadata = None
+        status_mtime = get_mtime(feed_status.STATUS_PATH)
         
-        # Update metadata
-        feed_info = {
-            'title': feed_title,
-            'slug': slug,
-            'fetchrss_url': fetchrss_url,
-            'accumulated_url': f'https://tommykhs.github.io/FBeed/feeds/{slug}.xml',
-            'description': feed_description,
-            'link': feed_link,
-            'last_updated': datetime.now(HK_TZ).isoformat(),
-            'status': 'success',
-            'total_posts': len(existing_guids),
-            'new_posts_this_run': new_items_count
-        }
-        update_metadata(metadata, feed_info)
+        interval = (config.get('settings') or {}).get('update_interval_minutes', 15)
+        next_cycle = get_next_cycle(time.time(), interval)
+        print(f"\n💤 Next cycle at {datetime.fromtimestamp(next_cycle, HK_TZ).strftime('%H:%M:%S')} HKT")
+        stopping.wait(max(0.0, next_cycle - time.time()))
     
-    # Save metadata
-    os.makedirs('metadata', exist_ok=True)
-    with open(metadata_path, 'w', encoding='utf-8') as f:
-        json.dump(metadata, f, ensure_ascii=False, indent=2)
+    if session is not None:
+        session.close()
+    print("👋 Daemon stopped")
+
+
+def main():
+    """Main execution function"""
+    parser = argparse.ArgumentParser(description='FBeed - Facebook Feed Accumulator')
+    parser.add_argument('--import', dest='import_feeds', action='store_true',
+                        help='re-import feeds/*.xml into the post store and exit')
+    parser.add_argument('--all', dest='fetch_all', action='store_true',
+                        help='fetch every feed, ignoring the adaptive polling schedule')
+    parser.add_argument('--profile', action='store_true',
+                        help=f'profile the run with cProfile and tracemalloc (saved to {PROFILE_PATH})')
+    parser.add_argument('--shard', type=parse_shard, metavar='i/N',
+                        help=f'only process shard i of N and write a partial status to {SHARD_DIR}')
+    parser.add_argument('--merge-shards', action='store_true',
+                        help=f'combine the partial status files in {SHARD_DIR} into {feed_status.STATUS_PATH}')
+    parser.add_argument('--daemon', action='store_true',
+                        help='keep running, with a fetch and render cycle every update_interval_minutes')
+    args = parser.parse_args()
     
-    print(f"\n✅ Feed accumulation complete!")
-    print(f"Metadata saved to {metadata_path}")
+    store = post_store.open_store()
+    try:
+        if args.import_feeds:
+            import_all_feeds(store)
+        elif args.merge_shards:
+            merge_shards(store)
+        elif args.daemon:
+            run_daemon(store, args.fetch_all)
+        elif args.profile:
+            profile_run(store, args.fetch_all, args.shard)
+        else:
+            run(store, args.fetch_all, args.shard)
+    finally:
+        store.close()
 
 
 if __name__ == '__main__':
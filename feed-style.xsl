@@ -212,8 +212,20 @@
                     });
                 }
                 
+                // Link a feed's pre-rendered pages: /FBeed/feeds/{slug}.xml → /FBeed/view/{slug}/
+                function linkFeedPages() {
+                    const match = location.pathname.match(/^(.*)\/feeds\/([^\/]+)\.xml$/);
+                    if (!match) return;
+                    const link = document.createElement('a');
+                    link.href = `${match[1]}/view/${match[2]}/`;
+                    link.textContent = 'Browse all posts';
+                    const container = document.getElementById('viewLink');
+                    container.append(' • ', link);
+                }
+                
                 // Run conversion when DOM is loaded
                 document.addEventListener('DOMContentLoaded', convertToHKTime);
+                document.addEventListener('DOMContentLoaded', linkFeedPages);
             </script>
         </head>
         <body>
@@ -225,11 +237,13 @@
                     </div>
                     <div class="feed-info">
                         RSS Feed • <xsl:value-of select="count(rss/channel/item)"/> Posts
+                        <span id="viewLink"></span>
                     </div>
                 </div>
                 
                 <div class="items">
-                    <xsl:for-each select="rss/channel/item">
+                    <!-- Only the newest posts; feed_pages.py renders every post as paginated HTML -->
+                    <xsl:for-each select="rss/channel/item[position() &lt;= 20]">
                         <div class="item">
                             <div class="item-title">
                                 <a href="{link}" target="_blank">
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+FBeed Feed Pages
+Pre-renders each accumulated feed as static, paginated HTML pages for browsers.
+"""
+
+import os
+import re
+import html
+import json
+import shutil
+import hashlib
+import argparse
+import tempfile
+from email.utils import parsedate_to_datetime
+from datetime import timezone, timedelta
+from urllib.parse import quote
+from jinja2 import Template
+from markupsafe import Markup
+import post_store
+
+VIEW_DIR = 'view'
+MANIFEST_PATH = f'{VIEW_DIR}/manifest.json'
+TEMPLATE_PATH = 'feed-page.html'
+
+# Changing this renumbers every page, so the next run renders them all again
+PAGE_SIZE = 50
+
+# Hong Kong timezone (UTC+8)
+HK_TZ = timezone(timedelta(hours=8))
+
+IMG_TAG_PATTERN = re.compile(r'<img\b(?![^>]*\bloading=)', re.IGNORECASE)
+
+# Compiled templates by path, with the mtime they were compiled at
+_templates = {}
+
+
+def get_view_url(slug):
+    """Site-relative URL of a feed's newest page, as linked from the dashboard"""
+    return f'{VIEW_DIR}/{quote(slug)}/'
+
+
+def get_page_path(slug, page):
+    """Path of a numbered page; a full page keeps its posts, so its URL never moves"""
+    return f'{VIEW_DIR}/{slug}/page-{page}.html'
+
+
+def get_index_path(slug):
+    return f'{VIEW_DIR}/{slug}/index.html'
+
+
+def get_template(path=TEMPLATE_PATH):
+    """Compiled page template, compiled again only when the file changes"""
+    mtime = os.path.getmtime(path)
+    if path not in _templates or _templates[path][0] != mtime:
+        with open(path, 'r', encoding='utf-8') as f:
+            _templates[path] = (mtime, Template(f.read(), autoescape=True, trim_blocks=True, lstrip_blocks=True))
+    return _templates[path][1]
+
+
+def load_manifest():
+    """Page hashes of the last build, or an empty manifest"""
+    manifest = None
+    if os.path.exists(MANIFEST_PATH):
+        with open(MANIFEST_PATH, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    if not manifest or manifest.get('page_size') != PAGE_SIZE:
+        manifest = {'version': 1, 'page_size': PAGE_SIZE, 'feeds': {}}
+    return manifest
+
+
+def write_if_changed(path, content):
+    """Atomically write bytes unless the file already holds them; return True if written"""
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            if f.read() == content:
+                return False
+
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return True
+
+
+def get_page_hash(header, guids, *extra):
+    """Hash of everything a page shows; posts are never rewritten once stored, so GUIDs stand in for them"""
+    data = json.dumps([header['title'], header['description'], *extra, guids], ensure_ascii=False)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()[:16]
+
+
+def format_hk_date(pub_date):
+    """An RFC 822 pubDate in Hong Kong time, as the XSL view showed it"""
+    try:
+        date = parsedate_to_datetime(pub_date)
+    except (TypeError, ValueError):
+        return pub_date
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date.astimezone(HK_TZ).strftime('%a, %d %b %Y %H:%M:%S +0800')
+
+
+def get_page_post(post):
+    """What a page shows for a stored post"""
+    description = post['description'] or ''
+    # FetchRSS usually embeds the media:content image in the description already
+    media_url = post['media_url']
+    if media_url and media_url in html.unescape(description):
+        media_url = None
+
+    return {
+        'title': post['title'] or '',
+        'link': post['link'] or '',
+        'date': format_hk_date(post['pub_date']) if post['pub_date'] else None,
+        'creator': post['creator'],
+        'description': Markup(IMG_TAG_PATTERN.sub('<img loading="lazy" decoding="async"', description)),
+        'media_url': media_url,
+        'media_medium': post['media_medium'],
+    }
+
+
+def render_page(template, store, header, slug, post_ids, page, page_count, total_posts=None):
+    """HTML of one numbered page, newest post first"""
+    posts = post_store.get_posts_by_id(store, post_ids)
+    return template.render(
+        title=header['title'] or slug,
+        description=header['description'] or '',
+        page=page,
+        total_posts=total_posts,
+        posts=[get_page_post(post) for post in posts],
+        newer_url=f'page-{page + 1}.html' if page < page_count else None,
+        older_url=f'page-{page - 1}.html' if page > 1 else None,
+        feed_url=f'../../feeds/{quote(slug)}.xml',
+        dashboard_url='../../',
+    ).encode('utf-8')
+
+
+def is_on_frozen_page(post, frozen_page):
+    """Whether a post was one of a full page's posts when it was frozen"""
+    first_ts, first_id, last_ts, last_id, max_id = frozen_page
+    key = (post['pub_ts'], -post['id'])
+    return post['id'] <= max_id and (first_ts, -first_id) <= key <= (last_ts, -last_id)
+
+
+def get_feed_pages(store, slug, frozen):
+    """Posts of each page of a feed, oldest first, freezing the pages that filled up"""
+    # A full page is recorded as the range of its posts plus the newest row id
+    # at the time. Posts stored later have higher ids, so they never join it:
+    # older posts backfilled afterwards start new pages after the frozen ones
+    # rather than renumbering them
+    posts = post_store.get_feed_post_keys(store, slug)
+    pages = [[] for _ in frozen]
+    rest = []
+    for post in posts:
+        page = next((index for index, frozen_page in enumerate(frozen) if is_on_frozen_page(post, frozen_page)), None)
+        (rest if page is None else pages[page]).append(post)
+
+    # A store imported again gives the posts new ids, so the numbering starts over
+    if any(len(page_posts) != PAGE_SIZE for page_posts in pages):
+        frozen.clear()
+        pages, rest = [], posts
+
+    max_id = max((post['id'] for post in posts), default=0)
+    for start in range(0, len(rest), PAGE_SIZE):
+        page_posts = rest[start:start + PAGE_SIZE]
+        if len(page_posts) == PAGE_SIZE:
+            frozen.append([page_posts[0]['pub_ts'], page_posts[0]['id'],
+                           page_posts[-1]['pub_ts'], page_posts[-1]['id'], max_id])
+        pages.append(page_posts)
+    return pages or [[]]
+
+
+def update_feed_pages(template, store, slug, state, rebuild=False):
+    """Render the pages of a feed whose items changed; return how many were written"""
+    header = post_store.get_feed_header(store, slug)
+    signature = [post_store.count_posts(store, slug), post_store.get_max_post_id(store, slug),
+                 header['title'], header['description']]
+    if not rebuild and state.get('signature') == signature and os.path.exists(get_index_path(slug)):
+        return 0
+
+    frozen = state.get('frozen', [])
+    pages = get_feed_pages(store, slug, frozen)
+    page_count = len(pages)
+    total_posts = sum(len(page_posts) for page_posts in pages)
+    old_hashes = state.get('pages', [])
+    hashes = []
+    written = 0
+    for page, page_posts in enumerate(pages, 1):
+        page_guids = [post['guid'] for post in page_posts]
+        post_ids = [post['id'] for post in page_posts]
+        # Whether a newer page exists changes the page's links, so it is hashed too
+        page_hash = get_page_hash(header, page_guids, page < page_count)
+        hashes.append(page_hash)
+
+        path = get_page_path(slug, page)
+        if rebuild or page > len(old_hashes) or old_hashes[page - 1] != page_hash or not os.path.exists(path):
+            written += write_if_changed(path, render_page(template, store, header, slug, post_ids, page, page_count))
+
+    # The landing page is the newest page plus the post count, so it changes with every new post
+    index_hash = get_page_hash(header, page_guids, total_posts)
+    if rebuild or state.get('index') != index_hash or not os.path.exists(get_index_path(slug)):
+        written += write_if_changed(get_index_path(slug), render_page(
+            template, store, header, slug, post_ids, page_count, page_count, total_posts))
+
+    # Drop pages left over from a feed that shrank
+    for page in range(page_count + 1, len(old_hashes) + 1):
+        if os.path.exists(get_page_path(slug, page)):
+            os.remove(get_page_path(slug, page))
+
+    state.update(signature=signature, pages=hashes, index=index_hash, frozen=frozen)
+    return written
+
+
+def update_pages(store, rebuild=False):
+    """Render the pages of every feed whose items changed; return how many were written"""
+    manifest = load_manifest()
+    template = get_template()
+
+    feeds = post_store.get_feed_titles(store)
+    written = 0
+    changed_feeds = 0
+    for slug in sorted(feeds):
+        count = update_feed_pages(template, store, slug, manifest['feeds'].setdefault(slug, {}), rebuild)
+        if count:
+            written += count
+            changed_feeds += 1
+
+    # Feeds no longer in the store lose their pages
+    for slug in sorted(set(manifest['feeds']) - set(feeds)):
+        shutil.rmtree(f'{VIEW_DIR}/{slug}', ignore_errors=True)
+        del manifest['feeds'][slug]
+
+    data = json.dumps(manifest, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    write_if_changed(MANIFEST_PATH, data)
+
+    if written:
+        print(f"✅ Wrote {written} pages of {changed_feeds} feeds to {VIEW_DIR}/")
+    else:
+        print("Feed pages are up to date")
+    return written
+
+
+def main():
+    """Main execution function"""
+    parser = argparse.ArgumentParser(description='FBeed - render paginated HTML pages of each feed')
+    parser.add_argument('--rebuild', action='store_true', help='render every page again')
+    args = parser.parse_args()
+
+    print("FBeed - Updating feed pages...")
+    if not os.path.exists(post_store.STORE_PATH):
+        print(f"⚠️  No post store at {post_store.STORE_PATH}, run fbeed.py first")
+        return
+
+    store = post_store.open_store()
+    try:
+        update_pages(store, args.rebuild)
+    finally:
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
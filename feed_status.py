@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+FBeed Feed Status
+metadata/feed-status.json held in memory keyed by FetchRSS URL, with a journal
+that checkpoints each feed as soon as it is processed.
+"""
+
+import os
+import json
+import tempfile
+
+STATUS_PATH = 'metadata/feed-status.json'
+
+
+def load_status(path=STATUS_PATH):
+    """Load a status file with its feeds keyed by FetchRSS URL"""
+    status = {'feeds': [], 'last_run': None}
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            status = json.load(f)
+    status['feeds'] = {feed['fetchrss_url']: feed for feed in status.get('feeds', [])}
+    return status
+
+
+def save_status(status, path=STATUS_PATH):
+    """Atomically write a status file, its feeds as the list generate_index.py reads"""
+    data = dict(status, feeds=list(status['feeds'].values()))
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix='.json')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def get_journal_path(path=STATUS_PATH):
+    """Checkpoint journal kept next to a status file while a run is in progress"""
+    return os.path.splitext(path)[0] + '.journal'
+
+
+def load_journal(journal_path):
+    """Header and feed checkpoints left by a run that didn't finish, or (None, [])"""
+    if not os.path.exists(journal_path):
+        return None, []
+
+    header = None
+    checkpoints = []
+    with open(journal_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A crash mid-write leaves at most the last line torn
+                break
+            if header is None:
+                header = record
+            else:
+                checkpoints.append(record)
+    return header, checkpoints
+
+
+def open_journal(journal_path, header=None):
+    """Open a journal for appending, starting it over with a header if one is given"""
+    os.makedirs(os.path.dirname(journal_path), exist_ok=True)
+    journal = open(journal_path, 'w' if header else 'a', encoding='utf-8')
+    if header:
+        append_checkpoint(journal, header)
+    return journal
+
+
+def append_checkpoint(journal, record):
+    """Durably append one record; one line per feed keeps checkpoints O(1) however many feeds there are"""
+    journal.write(json.dumps(record, ensure_ascii=False) + '\n')
+    journal.flush()
+    os.fsync(journal.fileno())
+
+
+def remove_journal(journal_path):
+    """Drop a journal once its checkpoints are in the status file"""
+    if os.path.exists(journal_path):
+        os.remove(journal_path)
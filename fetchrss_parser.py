@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+FBeed FetchRSS Parser
+Fast path for FetchRSS's fixed RSS 2.0 shape, falling back to feedparser for anything else.
+"""
+
+import io
+import re
+import sys
+import argparse
+from xml.etree import ElementTree as ET
+
+DC_CREATOR = '{http://purl.org/dc/elements/1.1/}creator'
+MEDIA_CONTENT = '{http://search.yahoo.com/mrss/}content'
+
+# Item children of a FetchRSS feed, and the entry keys feedparser files them under
+ITEM_FIELDS = {
+    'title': 'title',
+    'link': 'link',
+    'description': 'description',
+    DC_CREATOR: 'author',
+    'pubDate': 'published',
+    'guid': 'id',
+}
+CHANNEL_FIELDS = ('title', 'description', 'link')
+
+# The only markup FetchRSS puts in descriptions. feedparser's sanitizer leaves
+# these exactly as they are; anything else could be rewritten, so it goes to
+# feedparser instead.
+TAG_PATTERN = re.compile(r'<[^>]*>')
+SAFE_TAG_PATTERN = re.compile(
+    r'<br />|</a>|</span>'
+    r'|<img src="https?://[^"<>]*" />'
+    r'|<img height="\d+" src="https?://[^"<>]*" width="\d+" />'
+    r'|<a href="https?://[^"<>]*" target="_blank">'
+    r'|<span style="font-size: \d+px; color: [a-z]+;">'
+)
+ABSOLUTE_URL_PATTERN = re.compile(r'https?://[^\s<>"]+$')
+
+# Bare '&' in markup gets escaped and entity-like text gets decoded, so only
+# '&amp;' and a lone '&' followed by a space are left alone
+UNSAFE_ATTRIBUTE_AMPERSAND = re.compile(r'&(?!amp;)')
+ENTITY_LIKE_PATTERN = re.compile(r'&(?!amp;)[#\w]')
+
+# feedparser turns entities left in a link such as '&amp;' back into '&'
+URL_ENTITY_PATTERN = re.compile(r'&[#\w]+;')
+
+# feedparser remaps C1 control characters as cp1252 and splits '@' and '('
+# out of author names; values with these take the slow path
+C1_PATTERN = re.compile('[\x80-\x9f]')
+UNSAFE_AUTHOR_PATTERN = re.compile(r'[@()]')
+XML_DECLARATION_PATTERN = re.compile(rb'<\?xml[^>]*encoding=["\']([A-Za-z0-9_-]+)["\']')
+
+
+class NotFetchRSSShape(Exception):
+    """The document is not plain FetchRSS output and needs feedparser"""
+
+
+def check_text(value):
+    """Plain-text field feedparser would return unchanged"""
+    if '<' in value or C1_PATTERN.search(value):
+        raise NotFetchRSSShape(f'text needs decoding: {value[:40]!r}')
+    # feedparser re-decodes text that is entirely Latin-1 but reads as UTF-8
+    try:
+        redecoded = value.encode('iso-8859-1').decode('utf-8')
+    except UnicodeError:
+        return value
+    if redecoded != value:
+        raise NotFetchRSSShape(f'text needs re-decoding: {value[:40]!r}')
+    return value
+
+
+def check_url(value):
+    """Absolute URL feedparser would neither resolve nor rewrite"""
+    if not ABSOLUTE_URL_PATTERN.match(value) or URL_ENTITY_PATTERN.search(value):
+        raise NotFetchRSSShape(f'URL needs rewriting: {value[:40]!r}')
+    return check_text(value)
+
+
+def check_html(value):
+    """Description markup feedparser's sanitizer would leave untouched"""
+    for tag in TAG_PATTERN.findall(value):
+        if not SAFE_TAG_PATTERN.fullmatch(tag) or UNSAFE_ATTRIBUTE_AMPERSAND.search(tag):
+            raise NotFetchRSSShape(f'markup needs sanitizing: {tag[:40]!r}')
+    text = TAG_PATTERN.sub('', value)
+    if ENTITY_LIKE_PATTERN.search(text):
+        raise NotFetchRSSShape(f'text needs escaping: {text[:40]!r}')
+    check_text(text)
+    return value
+
+
+def get_field(elem, tag):
+    """Stripped text of an element, as feedparser returns it"""
+    text = (elem.text or '').strip()
+    if tag == 'description':
+        return check_html(text)
+    if tag == 'link':
+        return check_url(text)
+    if tag == DC_CREATOR and UNSAFE_AUTHOR_PATTERN.search(text):
+        raise NotFetchRSSShape(f'author needs splitting: {text[:40]!r}')
+    return check_text(text)
+
+
+def parse_item(item):
+    """Entry dict of a FetchRSS <item> with the keys feedparser would give it"""
+    entry = {}
+    media_content = []
+    for child in item:
+        if child.tag == MEDIA_CONTENT:
+            if set(child.keys()) - {'url', 'medium'} or len(child):
+                raise NotFetchRSSShape('unexpected media:content')
+            media = dict(child.items())
+            if 'url' in media and not ABSOLUTE_URL_PATTERN.match(media['url']):
+                raise NotFetchRSSShape(f"media URL needs resolving: {media['url'][:40]!r}")
+            media_content.append(media)
+        elif child.tag in ITEM_FIELDS and ITEM_FIELDS[child.tag] not in entry and not len(child):
+            entry[ITEM_FIELDS[child.tag]] = get_field(child, child.tag)
+        else:
+            raise NotFetchRSSShape(f'unexpected item element {child.tag}')
+
+    # A permalink guid stands in for a missing link, which feedparser does for us
+    if not entry.get('id') or ('link' not in entry and item.find('guid').get('isPermaLink') != 'false'):
+        raise NotFetchRSSShape('item without a guid and link')
+    if media_content:
+        entry['media_content'] = media_content
+    return entry
+
+
+def parse_fast(content):
+    """Parse a FetchRSS document, raising NotFetchRSSShape when it isn't one"""
+    declaration = XML_DECLARATION_PATTERN.match(content.lstrip())
+    if declaration and declaration.group(1).lower() not in (b'utf-8', b'utf8'):
+        raise NotFetchRSSShape('not UTF-8')
+
+    feed = {}
+    entries = []
+    depth = 0
+    try:
+        # Items are dropped as soon as they are converted, so only one is in memory
+        for event, elem in ET.iterparse(io.BytesIO(content), events=('start', 'end')):
+            if event == 'start':
+                depth += 1
+                if depth == 1 and (elem.tag != 'rss' or elem.get('version') != '2.0'):
+                    raise NotFetchRSSShape('not RSS 2.0')
+                if depth == 2 and elem.tag != 'channel':
+                    raise NotFetchRSSShape(f'unexpected element {elem.tag}')
+                continue
+
+            depth -= 1
+            if depth == 2 and elem.tag == 'item':
+                entries.append(parse_item(elem))
+                elem.clear()
+            elif depth == 2 and elem.tag in CHANNEL_FIELDS and elem.tag not in feed:
+                feed[elem.tag] = get_field(elem, elem.tag)
+    except ET.ParseError as e:
+        raise NotFetchRSSShape(f'not well-formed: {e}')
+
+    return {'feed': feed, 'entries': entries, 'bozo': False}
+
+
+def parse(content):
+    """Parse a fetched feed; FetchRSS output takes the fast path, anything else feedparser"""
+    try:
+        return parse_fast(content)
+    except NotFetchRSSShape:
+        # Imported lazily so runs that never need it don't pay for the import
+        import feedparser
+        return feedparser.parse(content)
+
+
+def get_parity_fields(parsed):
+    """The fields fbeed.py reads from a parse result, for comparing parsers"""
+    feed = parsed['feed']
+    return {
+        'feed': {field: feed.get(field) for field in CHANNEL_FIELDS},
+        'entries': [
+            {
+                **{key: entry.get(key) for key in ITEM_FIELDS.values()},
+                'media_content': [
+                    {'url': media.get('url'), 'medium': media.get('medium')}
+                    for media in entry.get('media_content') or []
+                ],
+            }
+            for entry in parsed['entries']
+        ],
+    }
+
+
+def main():
+    """Compare the fast path with feedparser on saved FetchRSS responses"""
+    parser = argparse.ArgumentParser(
+        description='FBeed - check the fast FetchRSS parser against feedparser')
+    parser.add_argument('files', nargs='+', help='RSS documents to parse with both parsers')
+    args = parser.parse_args()
+
+    import feedparser
+
+    fast = fallback = mismatched = 0
+    for path in args.files:
+        with open(path, 'rb') as f:
+            content = f.read()
+
+        try:
+            parsed = parse_fast(content)
+        except NotFetchRSSShape as e:
+            fallback += 1
+            print(f"↩️  {path}: falls back to feedparser ({e})")
+            continue
+
+        fast += 1
+        expected = get_parity_fields(feedparser.parse(content))
+        actual = get_parity_fields(parsed)
+        if actual != expected:
+            mismatched += 1
+            print(f"❌ {path}: fast path differs from feedparser")
+            for index, (got, want) in enumerate(zip(actual['entries'], expected['entries'])):
+                for key in want:
+                    if got[key] != want[key]:
+                        print(f"   entry {index} {key}: {got[key]!r} != {want[key]!r}")
+            if actual['feed'] != expected['feed'] or len(actual['entries']) != len(expected['entries']):
+                print(f"   feed: {actual['feed']!r} != {expected['feed']!r}")
+
+    print(f"\n{fast} fast path ({mismatched} mismatched), {fallback} fell back to feedparser")
+    sys.exit(1 if mismatched else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,30 @@
 #!/usr/bin/env python3
 """
 FBeed Dashboard Generator
-Generates index.html dashboard from feed metadata with HK timezone
+Generates dashboard.json from feed metadata and the index.html shell that renders it
 """
 
 import json
 import os
+import gzip
+import argparse
+import tempfile
 from datetime import datetime
 from jinja2 import Template
 import pytz
 from xml.etree import ElementTree as ET
+import run_stats
+import feed_pages
+
+TEMPLATE_PATH = 'template.html'
+INDEX_PATH = 'index.html'
+
+# Feed rows and run stats the page shell fetches and renders
+DASHBOARD_PATH = 'dashboard.json'
+DASHBOARD_COLUMNS = ('title', 'url', 'posts', 'latest', 'status', 'error', 'view')
+
+# Compiled templates by path, with the mtime they were compiled at
+_templates = {}
 
 
 def load_metadata():
@@ -42,225 +57,149 @@ def format_hk_time(utc_time_str):
         return utc_time_str
 
 
-def get_relative_time(utc_time_str):
-    """Get relative time (e.g., '2 min ago')"""
-    if not utc_time_str:
-        return 'Never'
-    
-    try:
-        utc_time = datetime.fromisoformat(utc_time_str.replace('Z', '+00:00'))
-        now = datetime.now(pytz.UTC)
-        delta = now - utc_time
-        
-        seconds = delta.total_seconds()
-        
-        if seconds < 60:
-            return f"{int(seconds)} sec ago"
-        elif seconds < 3600:
-            return f"{int(seconds / 60)} min ago"
-        elif seconds < 86400:
-            return f"{int(seconds / 3600)} hr ago"
-        else:
-            return f"{int(seconds / 86400)} days ago"
-    except:
-        return 'Unknown'
-
-
-def get_status_icon(status):
-    """Get status icon emoji"""
-    status_map = {
-        'success': '✅',
-        'warning': '⚠️',
-        'error': '❌'
-    }
-    return status_map.get(status, '❓')
-
-
 def get_latest_post_time(feed_slug):
-    """Get the latest post pubDate from the feed XML"""
+    """Get the latest post pubDate from the feed XML, stopping at the first item"""
     feed_path = f'feeds/{feed_slug}.xml'
     if not os.path.exists(feed_path):
         return None
     
     try:
-        tree = ET.parse(feed_path)
-        root = tree.getroot()
-        channel = root.find('channel')
-        
-        if channel is None:
-            return None
-        
-        # Get first item (newest post)
-        item = channel.find('item')
-        if item is None:
+        # Stream only as far as the first item (newest post)
+        for _, elem in ET.iterparse(feed_path):
+            if elem.tag != 'item':
+                continue
+            
+            pubdate = elem.findtext('pubDate')
+            if pubdate:
+                # Parse RFC 2822 date format
+                from email.utils import parsedate_to_datetime
+                return parsedate_to_datetime(pubdate).isoformat()
             return None
         
-        pubdate = item.find('pubDate')
-        if pubdate is not None and pubdate.text:
-            # Parse RFC 2822 date format
-            from email.utils import parsedate_to_datetime
-            dt = parsedate_to_datetime(pubdate.text)
-            return dt.isoformat()
-        
         return None
     except Exception as e:
         print(f"Error reading latest post time from {feed_path}: {e}")
         return None
 
 
-def generate_dashboard():
-    """Generate the HTML dashboard"""
-    print("FBeed - Generating dashboard...")
+def get_run_summary():
+    """Per-stage timings of the latest recorded run, for the dashboard footer"""
+    run = run_stats.get_latest_run()
+    if not run:
+        return None
     
-    # Load metadata
-    metadata = load_metadata()
+    slowest = run['slowest'][0] if run.get('slowest') else None
+    return {
+        'duration': f"{run['duration']:.1f}s",
+        'stages': run_stats.format_stages(run['stages']),
+        'slowest': f"{slowest['slug']} ({slowest['seconds']:.1f}s)" if slowest else None,
+    }
+
+
+def get_template(path=TEMPLATE_PATH):
+    """Compiled Jinja template, compiled again only when the file changes"""
+    mtime = os.path.getmtime(path)
+    if path not in _templates or _templates[path][0] != mtime:
+        with open(path, 'r', encoding='utf-8') as f:
+            _templates[path] = (mtime, Template(f.read()))
+    return _templates[path][1]
+
+
+def write_if_changed(path, content):
+    """Atomically write bytes unless the file already holds them; return True if written"""
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            if f.read() == content:
+                return False
     
-    # Process feeds data for template
-    feeds_data = []
-    for feed in metadata.get('feeds', []):
-        # Get slug and check if XML file exists
-        slug = feed.get('slug', '')
-        feed_xml_path = f'feeds/{slug}.xml'
-        
-        # Skip if XML file doesn't exist
-        if not os.path.exists(feed_xml_path):
-            print(f"⚠️  Skipping {slug} - XML file not found")
-            continue
-        
-        # Crop " on Facebook" from title
-        title = feed.get('title', 'Untitled')
-        title = title.replace(' on Facebook', '')
-        
-        # Get latest post time from XML feed
+    directory = os.path.dirname(path) or '.'
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return True
+
+
+def get_feed_row(feed):
+    """Dashboard row of a feed in DASHBOARD_COLUMNS order, or None if its XML is missing"""
+    slug = feed.get('slug', '')
+    if not os.path.exists(f'feeds/{slug}.xml'):
+        print(f"⚠️  Skipping {slug} - XML file not found")
+        return None
+    
+    # Latest post time is recorded by fbeed.py; older metadata falls back to the XML
+    if 'latest_post_time' in feed:
+        latest_post_time = feed['latest_post_time']
+    else:
         latest_post_time = get_latest_post_time(slug)
-        
-        feeds_data.append({
-            'title': title,
-            'fetchrss_url': feed.get('fetchrss_url', ''),
-            'accumulated_url': feed.get('accumulated_url', ''),
-            'last_updated': format_hk_time(latest_post_time) if latest_post_time else 'Never',
-            'total_posts': feed.get('total_posts', 0),
-            'new_posts': feed.get('new_posts_this_run', 0),
-            'status': feed.get('status', 'unknown'),
-            'status_icon': get_status_icon(feed.get('status', 'unknown')),
-            'description': feed.get('description', '')
-        })
     
-    # Last run time
-    last_run = format_hk_time(metadata.get('last_run'))
+    return [
+        feed.get('title', 'Untitled').replace(' on Facebook', ''),
+        feed.get('accumulated_url', ''),
+        feed.get('total_posts', 0),
+        # Epoch seconds; the page formats them in Hong Kong time
+        int(datetime.fromisoformat(latest_post_time).timestamp()) if latest_post_time else None,
+        feed.get('status', 'unknown'),
+        feed.get('last_error') or None,
+        # Paginated HTML pages from feed_pages.py, if they have been rendered
+        feed_pages.get_view_url(slug) if os.path.exists(feed_pages.get_index_path(slug)) else None,
+    ]
+
+
+def generate_dashboard(gzip_data=False, metadata=None):
+    """Write dashboard.json and the page shell that renders it, from metadata already in memory if given"""
+    print("FBeed - Generating dashboard...")
     
-    # Load HTML template
-    template_path = 'template.html'
-    if os.path.exists(template_path):
-        with open(template_path, 'r', encoding='utf-8') as f:
-            template_content = f.read()
-    else:
-        # Use inline template if file doesn't exist
-        template_content = get_inline_template()
+    # Load metadata
+    if metadata is None:
+        metadata = load_metadata()
+    rows = []
+    for feed in metadata.get('feeds', []):
+        row = get_feed_row(feed)
+        if row:
+            rows.append(row)
     
-    # Render template
-    template = Template(template_content)
-    html_output = template.render(
-        feeds=feeds_data,
-        last_run=last_run,
-        total_feeds=len(feeds_data),
-        total_posts=sum(f['total_posts'] for f in feeds_data)
-    )
+    # Rows as arrays under a shared column list keep the file small; nothing
+    # in it depends on when it was generated, so idle runs leave it as is
+    data = json.dumps({
+        'columns': DASHBOARD_COLUMNS,
+        'feeds': rows,
+        'last_run': metadata.get('last_run'),
+        'run': get_run_summary(),
+    }, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    changed = write_if_changed(DASHBOARD_PATH, data)
     
-    # Save to index.html
-    with open('index.html', 'w', encoding='utf-8') as f:
-        f.write(html_output)
+    # Pre-compressed copy for servers that serve .gz files as-is
+    if gzip_data:
+        changed |= write_if_changed(f'{DASHBOARD_PATH}.gz', gzip.compress(data, mtime=0))
+    elif os.path.exists(f'{DASHBOARD_PATH}.gz'):
+        os.remove(f'{DASHBOARD_PATH}.gz')
     
-    print(f"✅ Dashboard generated: index.html")
-    print(f"   Total feeds: {len(feeds_data)}")
-    print(f"   Total posts: {sum(f['total_posts'] for f in feeds_data)}")
-    print(f"   Last run: {last_run}")
+    # The shell only changes with the template, so it is usually left untouched
+    html_output = get_template().render(dashboard_url=DASHBOARD_PATH)
+    changed |= write_if_changed(INDEX_PATH, html_output.encode('utf-8'))
+    
+    total_posts = sum(row[DASHBOARD_COLUMNS.index('posts')] for row in rows)
+    print(f"✅ Dashboard {'generated' if changed else 'unchanged'}: {INDEX_PATH}, {DASHBOARD_PATH} ({len(data)} bytes)")
+    print(f"   Total feeds: {len(rows)}")
+    print(f"   Total posts: {total_posts}")
+    print(f"   Last run: {format_hk_time(metadata.get('last_run'))}")
 
 
-def get_inline_template():
-    """Fallback inline template"""
-    return """<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>FBeed Dashboard</title>
-    <link rel="stylesheet" href="style.css">
-</head>
-<body>
-    <div class="container">
-        <header>
-            <h1>📋 FBeed Dashboard</h1>
-            <p class="subtitle">Facebook Feed Accumulator</p>
-        </header>
-        
-        <div class="stats">
-            <div class="stat-card">
-                <div class="stat-value">{{ total_feeds }}</div>
-                <div class="stat-label">Active Feeds</div>
-            </div>
-            <div class="stat-card">
-                <div class="stat-value">{{ total_posts }}</div>
-                <div class="stat-label">Total Posts</div>
-            </div>
-            <div class="stat-card">
-                <div class="stat-value">{{ last_run }}</div>
-                <div class="stat-label">Last Update</div>
-            </div>
-        </div>
-        
-        <div class="table-container">
-            <table class="feed-table">
-                <thead>
-                    <tr>
-                        <th>Feed Name</th>
-                        <th>FetchRSS Source</th>
-                        <th>Accumulated Feed</th>
-                        <th>Last Updated</th>
-                        <th>Posts</th>
-                        <th>Status</th>
-                    </tr>
-                </thead>
-                <tbody>
-                    {% for feed in feeds %}
-                    <tr>
-                        <td class="feed-title">{{ feed.title }}</td>
-                        <td><a href="{{ feed.fetchrss_url }}" target="_blank" class="btn-link">Source →</a></td>
-                        <td>
-                            <button class="btn-copy" onclick="copyToClipboard('{{ feed.accumulated_url }}')">
-                                📋 Copy RSS
-                            </button>
-                        </td>
-                        <td class="time-cell">
-                            <div class="relative-time">{{ feed.relative_time }}</div>
-                            <div class="absolute-time">{{ feed.last_updated }}</div>
-                        </td>
-                        <td class="posts-count">{{ feed.total_posts }}</td>
-                        <td class="status-cell">{{ feed.status_icon }}</td>
-                    </tr>
-                    {% endfor %}
-                </tbody>
-            </table>
-        </div>
-        
-        <footer>
-            <p>Updated every 15 minutes via GitHub Actions</p>
-            <p>Powered by <a href="https://github.com/tommykhs/FBeed">FBeed</a></p>
-        </footer>
-    </div>
-    
-    <script>
-        function copyToClipboard(text) {
-            navigator.clipboard.writeText(text).then(() => {
-                alert('RSS URL copied to clipboard!');
-            }).catch(err => {
-                console.error('Failed to copy:', err);
-            });
-        }
-    </script>
-</body>
-</html>"""
+def main():
+    """Main execution function"""
+    parser = argparse.ArgumentParser(description='FBeed - generate the dashboard')
+    parser.add_argument('--gzip', action='store_true',
+                        help=f'also write a pre-compressed {DASHBOARD_PATH}.gz')
+    args = parser.parse_args()
+    generate_dashboard(args.gzip)
 
 
 if __name__ == '__main__':
-    generate_dashboard()
+    main()
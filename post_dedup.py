@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+FBeed Post Dedup
+Content-addresses stored posts and flags reposts of the same article or image across feeds.
+"""
+
+import os
+import re
+import hashlib
+import argparse
+import functools
+import unicodedata
+from collections import Counter
+from urllib.parse import urlparse
+import post_store
+from search_index import CJK_RUN, TOKEN_PATTERN, get_plain_text
+
+# Two posts are near-duplicates when their 64-bit SimHashes differ in at most
+# this many bits. Split into 4 bands of 16 bits, two such sketches always
+# share a band exactly, so candidates come from an index lookup.
+MAX_DISTANCE = 3
+BAND_BITS = 16
+BAND_COUNT = 64 // BAND_BITS
+
+# Han, kana and Hangul runs are cut into overlapping shingles of this many
+# characters, other text into words
+SHINGLE_LENGTH = 3
+
+# Shorter texts ("Photo", a link alone) match too easily to be sketched;
+# they only dedupe on an exact content hash, and only with the same image
+MIN_SKETCH_SHINGLES = 16
+
+FOOTER_PATTERN = re.compile(r'\(Feed generated with FetchRSS\)')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+# BIT_TABLES[k] maps a byte to 1 if its bit k is set, so bytes.translate()
+# and count() total a bit position over every token hash at C speed
+BIT_TABLES = [bytes((value >> bit) & 1 for value in range(256)) for bit in range(8)]
+
+
+def normalize_text(post):
+    """Description (or title) text without markup, FetchRSS's footer or spacing differences"""
+    text = get_plain_text(post['description'] or post['title'])
+    text = unicodedata.normalize('NFKC', FOOTER_PATTERN.sub(' ', text)).lower()
+    return WHITESPACE_PATTERN.sub(' ', text).strip()
+
+
+def normalize_media_url(url):
+    """Media URL without the signed query string; Facebook's CDN hosts vary, so only the file name counts there"""
+    if not url:
+        return None
+    parsed = urlparse(url)
+    if parsed.netloc.endswith('fbcdn.net'):
+        return os.path.basename(parsed.path)
+    return parsed.netloc + parsed.path
+
+
+def get_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def get_shingles(text):
+    """Shingle counts of a normalized text"""
+    shingles = []
+    for match in TOKEN_PATTERN.finditer(text):
+        run = match.group()
+        if CJK_RUN.match(run) and len(run) > SHINGLE_LENGTH:
+            shingles.extend(run[i:i + SHINGLE_LENGTH] for i in range(len(run) - SHINGLE_LENGTH + 1))
+        else:
+            shingles.append(run)
+    return Counter(shingles)
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def get_shingle_digest(shingle):
+    """64-bit hash of a shingle; common shingles recur across posts, so digests are cached"""
+    return hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest()
+
+
+def get_simhash(shingles):
+    """64-bit SimHash of shingle counts, each shingle weighted by how often it occurs"""
+    # Each shingle's digest is repeated by its weight
+    digests = b''.join(get_shingle_digest(shingle) * count for shingle, count in shingles.items())
+    threshold = sum(shingles.values()) / 2
+    simhash = 0
+    for byte in range(8):
+        column = digests[byte::8]
+        for bit in range(8):
+            if column.translate(BIT_TABLES[bit]).count(1) > threshold:
+                simhash |= 1 << (byte * 8 + bit)
+    return simhash
+
+
+def get_bands(simhash):
+    return [(simhash >> (band * BAND_BITS)) & ((1 << BAND_BITS) - 1) for band in range(BAND_COUNT)]
+
+
+def to_signed(value):
+    """SQLite integers are signed 64-bit"""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def is_duplicate(signature, candidate):
+    """Whether a candidate's sketch marks the post as a repost of it"""
+    # The same caption over a different image is a different post
+    if signature['media_hash'] and candidate['media_hash'] and signature['media_hash'] != candidate['media_hash']:
+        return False
+    if signature['content_hash'] == candidate['content_hash']:
+        return True
+    if signature['simhash'] is None or candidate['simhash'] is None:
+        return False
+    return ((signature['simhash'] ^ candidate['simhash']) & ((1 << 64) - 1)).bit_count() <= MAX_DISTANCE
+
+
+def get_signature(post):
+    """Content hash, media hash and SimHash of a post"""
+    text = normalize_text(post)
+    media = normalize_media_url(post['media_url'])
+    shingles = get_shingles(text)
+    simhash = get_simhash(shingles) if sum(shingles.values()) >= MIN_SKETCH_SHINGLES else None
+    return {
+        'matchable': simhash is not None or media is not None,
+        'content_hash': get_hash(f'{text}\n{media or ""}'),
+        'media_hash': get_hash(media) if media else None,
+        'simhash': to_signed(simhash) if simhash is not None else None,
+        'bands': get_bands(simhash) if simhash is not None else None,
+    }
+
+
+def get_original_key(row):
+    """Order deciding which copy is the original: the earliest post, then feed and GUID"""
+    return (row['pub_ts'], row['feed'], row['guid'])
+
+
+def find_originals(store, post, signature):
+    """Originals of every group of copies this post matches"""
+    if not signature['matchable']:
+        return []
+
+    originals = set()
+    for candidate in post_store.find_similar_content(store, post['feed'], signature['content_hash'], signature['bands']):
+        if is_duplicate(signature, candidate):
+            originals.add(candidate['duplicate_of'] or candidate['post_id'])
+    return [post_store.get_post_content(store, post_id) for post_id in sorted(originals)]
+
+
+def update_signatures(store):
+    """Sign the posts added since the last pass and flag reposts; return how many were signed"""
+    signed = duplicates = 0
+    for post in post_store.iter_unsigned_posts(store).fetchall():
+        signature = get_signature(post)
+        originals = find_originals(store, post, signature)
+
+        # The post joins every group it matches. The earliest post of the merged
+        # group is its original, so the outcome doesn't depend on the order
+        # feeds were stored in.
+        earliest = min([post, *originals], key=get_original_key)
+        post_store.add_post_content(
+            store, post['id'], post['feed'], signature['content_hash'], signature['media_hash'],
+            signature['simhash'], signature['bands'], None if earliest is post else earliest['id'])
+        for original in originals:
+            if original['post_id'] != earliest['id']:
+                post_store.set_original(store, original['post_id'], earliest['id'])
+        signed += 1
+        duplicates += bool(originals)
+    store.commit()
+
+    if signed:
+        print(f"🧬 Signed {signed} new posts, {duplicates} matched posts of other feeds")
+    return signed
+
+
+def get_dedup_report(store):
+    """Dedup ratio of the store, as recorded in feed-status.json"""
+    stats = post_store.get_dedup_stats(store)
+    stats['ratio'] = round(stats['duplicates'] / stats['posts'], 4) if stats['posts'] else 0.0
+    return stats
+
+
+def print_report(report):
+    print(f"🧬 {report['duplicates']} of {report['posts']} posts are reposts "
+          f"({report['ratio']:.1%}, {report['duplicate_bytes'] / 1024:.0f} KiB of repeated descriptions)")
+
+
+def main():
+    """Main execution function"""
+    parser = argparse.ArgumentParser(description='FBeed - flag reposts across feeds and report the dedup ratio')
+    parser.add_argument('--rebuild', action='store_true', help='sign every post again')
+    args = parser.parse_args()
+
+    if not os.path.exists(post_store.STORE_PATH):
+        print(f"⚠️  No post store at {post_store.STORE_PATH}, run fbeed.py first")
+        return
+
+    store = post_store.open_store()
+    try:
+        if args.rebuild:
+            post_store.clear_post_content(store)
+        update_signatures(store)
+        print_report(get_dedup_report(store))
+    finally:
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
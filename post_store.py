@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+"""
+FBeed Post Store
+SQLite store of accumulated posts, the source of truth for feed XML and stats.
+"""
+
+import os
+import sqlite3
+
+STORE_PATH = 'metadata/posts.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS feeds (
+    slug TEXT PRIMARY KEY,
+    title TEXT,
+    description TEXT,
+    link TEXT,
+    pub_date TEXT,
+    image_url TEXT,
+    image_title TEXT,
+    image_link TEXT,
+    generator TEXT
+);
+
+-- id doubles as insertion order, which breaks pubDate ties the same way
+-- the old stable sort did (existing posts first, then fetch order)
+CREATE TABLE IF NOT EXISTS posts (
+    id INTEGER PRIMARY KEY,
+    feed TEXT NOT NULL,
+    guid TEXT NOT NULL,
+    pub_ts REAL NOT NULL,
+    pub_date TEXT,
+    title TEXT,
+    link TEXT,
+    description TEXT,
+    creator TEXT,
+    has_media INTEGER NOT NULL DEFAULT 0,
+    media_url TEXT,
+    media_medium TEXT,
+    archive_page TEXT,
+    UNIQUE (feed, guid)
+);
+
+CREATE INDEX IF NOT EXISTS posts_by_feed_date ON posts (feed, archive_page, pub_ts DESC, id);
+CREATE INDEX IF NOT EXISTS posts_by_date ON posts (pub_ts DESC, id);
+CREATE INDEX IF NOT EXISTS posts_by_feed_all_dates ON posts (feed, pub_ts DESC, id);
+
+CREATE TABLE IF NOT EXISTS archives (
+    feed TEXT NOT NULL,
+    path TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    pub_date TEXT,
+    PRIMARY KEY (feed, path)
+);
+
+-- Content address and similarity sketch of each post, filled in by
+-- post_dedup.py; duplicate_of is the earliest matching post of another feed
+CREATE TABLE IF NOT EXISTS post_content (
+    post_id INTEGER PRIMARY KEY,
+    feed TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    media_hash TEXT,
+    simhash INTEGER,
+    band0 INTEGER,
+    band1 INTEGER,
+    band2 INTEGER,
+    band3 INTEGER,
+    duplicate_of INTEGER
+);
+
+CREATE INDEX IF NOT EXISTS post_content_by_hash ON post_content (content_hash);
+CREATE INDEX IF NOT EXISTS post_content_by_band0 ON post_content (band0);
+CREATE INDEX IF NOT EXISTS post_content_by_band1 ON post_content (band1);
+CREATE INDEX IF NOT EXISTS post_content_by_band2 ON post_content (band2);
+CREATE INDEX IF NOT EXISTS post_content_by_band3 ON post_content (band3);
+CREATE INDEX IF NOT EXISTS post_content_by_duplicate ON post_content (duplicate_of);
+"""
+
+POST_COLUMNS = (
+    'guid', 'pub_ts', 'pub_date', 'title', 'link', 'description',
+    'creator', 'has_media', 'media_url', 'media_medium'
+)
+
+HEADER_COLUMNS = (
+    'title', 'description', 'link', 'pub_date',
+    'image_url', 'image_title', 'image_link', 'generator'
+)
+
+
+def open_store(path=STORE_PATH):
+    """Open (and create if needed) the post store"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Sharded runs on one machine share the store, so wait for another
+    # process's write to finish rather than failing
+    conn = sqlite3.connect(path, timeout=60)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def has_feed(conn, slug):
+    """Whether the store already holds a feed"""
+    return conn.execute('SELECT 1 FROM feeds WHERE slug = ?', (slug,)).fetchone() is not None
+
+
+def add_feed(conn, slug, header):
+    """Insert a feed's channel header"""
+    columns = ', '.join(HEADER_COLUMNS)
+    placeholders = ', '.join('?' for _ in HEADER_COLUMNS)
+    conn.execute(
+        f'INSERT OR REPLACE INTO feeds (slug, {columns}) VALUES (?, {placeholders})',
+        (slug, *(header.get(column) for column in HEADER_COLUMNS))
+    )
+
+
+def get_feed_header(conn, slug):
+    """Channel header fields of a feed"""
+    row = conn.execute('SELECT * FROM feeds WHERE slug = ?', (slug,)).fetchone()
+    return dict(row) if row else None
+
+
+def set_feed_pub_date(conn, slug, pub_date):
+    """Update a feed's channel pubDate"""
+    conn.execute('UPDATE feeds SET pub_date = ? WHERE slug = ?', (pub_date, slug))
+
+
+def insert_posts(conn, slug, posts):
+    """Upsert posts keyed by (feed, guid), keeping stored ones as-is; return the number added"""
+    columns = ', '.join(POST_COLUMNS)
+    placeholders = ', '.join('?' for _ in POST_COLUMNS)
+    added = 0
+    for post in posts:
+        cursor = conn.execute(
+            f'INSERT INTO posts (feed, {columns}) VALUES (?, {placeholders}) '
+            'ON CONFLICT (feed, guid) DO NOTHING',
+            (slug, *(post.get(column) for column in POST_COLUMNS))
+        )
+        added += cursor.rowcount
+    return added
+
+
+def get_post_ids(conn, slug, guids):
+    """Row ids of a feed's posts with the given GUIDs"""
+    guids = list(guids)
+    ids = []
+    # Stay well below SQLite's bound parameter limit
+    for start in range(0, len(guids), 500):
+        chunk = guids[start:start + 500]
+        placeholders = ', '.join('?' for _ in chunk)
+        rows = conn.execute(
+            f'SELECT id FROM posts WHERE feed = ? AND guid IN ({placeholders})',
+            (slug, *chunk)
+        )
+        ids.extend(row['id'] for row in rows)
+    return ids
+
+
+def get_feed_guids(conn, slug):
+    """All GUIDs stored for a feed"""
+    return [row['guid'] for row in conn.execute('SELECT guid FROM posts WHERE feed = ?', (slug,))]
+
+
+def count_posts(conn, slug, head_only=False):
+    """Number of posts stored for a feed, optionally only those not archived"""
+    query = 'SELECT COUNT(*) FROM posts WHERE feed = ?'
+    if head_only:
+        query += ' AND archive_page IS NULL'
+    return conn.execute(query, (slug,)).fetchone()[0]
+
+
+def iter_posts(conn, slug, archive_page=None):
+    """Posts of the head feed (or one archive page), newest first"""
+    if archive_page is None:
+        return conn.execute(
+            'SELECT * FROM posts WHERE feed = ? AND archive_page IS NULL ORDER BY pub_ts DESC, id',
+            (slug,)
+        )
+    return conn.execute(
+        'SELECT * FROM posts WHERE feed = ? AND archive_page = ? ORDER BY pub_ts DESC, id',
+        (slug, archive_page)
+    )
+
+
+def iter_all_posts(conn, slug):
+    """Every post of a feed across the head and its archive pages, newest first"""
+    return conn.execute(
+        'SELECT * FROM posts WHERE feed = ? ORDER BY pub_ts DESC, id', (slug,)
+    )
+
+
+def get_feed_post_keys(conn, slug):
+    """Row id, pub_ts and GUID of a feed's posts across the head and archives, oldest first"""
+    return conn.execute(
+        'SELECT id, pub_ts, guid FROM posts WHERE feed = ? ORDER BY pub_ts ASC, id DESC', (slug,)
+    ).fetchall()
+
+
+def get_posts_by_id(conn, post_ids):
+    """Posts with the given row ids, newest first"""
+    post_ids = list(post_ids)
+    placeholders = ', '.join('?' for _ in post_ids)
+    return conn.execute(
+        f'SELECT * FROM posts WHERE id IN ({placeholders}) ORDER BY pub_ts DESC, id',
+        post_ids
+    ).fetchall()
+
+
+def get_max_post_id(conn, slug):
+    """Row id of a feed's most recently inserted post, or None"""
+    return conn.execute('SELECT MAX(id) FROM posts WHERE feed = ?', (slug,)).fetchone()[0]
+
+
+def get_oldest_head_posts(conn, slug, limit):
+    """The oldest posts still in the head feed, newest first"""
+    rows = conn.execute(
+        'SELECT * FROM posts WHERE feed = ? AND archive_page IS NULL '
+        'ORDER BY pub_ts ASC, id DESC LIMIT ?',
+        (slug, limit)
+    ).fetchall()
+    return rows[::-1]
+
+
+def get_backfilled_posts(conn, slug, after_id, before_ts):
+    """Head posts inserted after a row id that are dated before a timestamp, oldest first"""
+    return conn.execute(
+        'SELECT * FROM posts WHERE feed = ? AND archive_page IS NULL AND id > ? AND pub_ts > 0 AND pub_ts < ? '
+        'ORDER BY pub_ts ASC, id DESC',
+        (slug, after_id, before_ts)
+    ).fetchall()
+
+
+def get_namespace_flags(conn, slug, archive_page=None):
+    """Whether the head (or an archive page) has any dc:creator / media:content"""
+    page_filter = 'archive_page IS NULL' if archive_page is None else 'archive_page = ?'
+    params = (slug,) if archive_page is None else (slug, archive_page)
+    row = conn.execute(
+        'SELECT '
+        f'EXISTS (SELECT 1 FROM posts WHERE feed = ? AND {page_filter} AND creator IS NOT NULL), '
+        f'EXISTS (SELECT 1 FROM posts WHERE feed = ? AND {page_filter} AND has_media)',
+        params + params
+    ).fetchone()
+    return {'creator': bool(row[0]), 'media': bool(row[1])}
+
+
+def list_archives(conn, slug):
+    """Archive pages of a feed, oldest first"""
+    return conn.execute(
+        'SELECT * FROM archives WHERE feed = ? ORDER BY position', (slug,)
+    ).fetchall()
+
+
+def add_archive(conn, slug, path, pub_date, post_ids):
+    """Record a new archive page and move the given posts into it"""
+    position = conn.execute(
+        'SELECT COALESCE(MAX(position), 0) + 1 FROM archives WHERE feed = ?', (slug,)
+    ).fetchone()[0]
+    conn.execute(
+        'INSERT INTO archives (feed, path, position, pub_date) VALUES (?, ?, ?, ?)',
+        (slug, path, position, pub_date)
+    )
+    conn.executemany(
+        'UPDATE posts SET archive_page = ? WHERE id = ?',
+        [(path, post_id) for post_id in post_ids]
+    )
+
+
+def get_newest_archived_timestamp(conn, slug):
+    """pub_ts of a feed's newest archived post, or None"""
+    return conn.execute(
+        'SELECT MAX(pub_ts) FROM posts WHERE feed = ? AND archive_page IS NOT NULL', (slug,)
+    ).fetchone()[0]
+
+
+def set_archive_order(conn, slug, paths):
+    """Renumber a feed's archive pages in the given order, oldest first"""
+    conn.executemany(
+        'UPDATE archives SET position = ? WHERE feed = ? AND path = ?',
+        [(position, slug, path) for position, path in enumerate(paths, 1)]
+    )
+
+
+def delete_feed(conn, slug):
+    """Remove a feed and everything stored for it"""
+    # Posts of other feeds that duplicated this feed's posts become originals
+    conn.execute(
+        'UPDATE post_content SET duplicate_of = NULL WHERE duplicate_of IN '
+        '(SELECT post_id FROM post_content WHERE feed = ?)', (slug,)
+    )
+    conn.execute('DELETE FROM post_content WHERE feed = ?', (slug,))
+    conn.execute('DELETE FROM posts WHERE feed = ?', (slug,))
+    conn.execute('DELETE FROM archives WHERE feed = ?', (slug,))
+    conn.execute('DELETE FROM feeds WHERE slug = ?', (slug,))
+
+
+def get_latest_post(conn, slug):
+    """Newest post of the head feed, or None"""
+    return conn.execute(
+        'SELECT * FROM posts WHERE feed = ? AND archive_page IS NULL ORDER BY pub_ts DESC, id LIMIT 1',
+        (slug,)
+    ).fetchone()
+
+
+def get_recent_timestamps(conn, slug, limit):
+    """pub_ts of the newest head posts, newest first, skipping undated ones"""
+    rows = conn.execute(
+        'SELECT pub_ts FROM posts WHERE feed = ? AND archive_page IS NULL AND pub_ts > 0 '
+        'ORDER BY pub_ts DESC LIMIT ?',
+        (slug, limit)
+    )
+    return [row['pub_ts'] for row in rows]
+
+
+def iter_posts_after(conn, post_id):
+    """Posts of every feed added after a row id, in insertion order"""
+    return conn.execute('SELECT * FROM posts WHERE id > ? ORDER BY id', (post_id,))
+
+
+def count_posts_up_to(conn, post_id):
+    """Number of stored posts with a row id up to post_id"""
+    return conn.execute('SELECT COUNT(*) FROM posts WHERE id <= ?', (post_id,)).fetchone()[0]
+
+
+def get_feed_titles(conn):
+    """Channel title of every feed, keyed by slug"""
+    return {row['slug']: row['title'] for row in conn.execute('SELECT slug, title FROM feeds')}
+
+
+def iter_unsigned_posts(conn):
+    """Posts without a post_content row yet, in insertion order"""
+    return conn.execute(
+        'SELECT posts.* FROM posts LEFT JOIN post_content ON post_content.post_id = posts.id '
+        'WHERE post_content.post_id IS NULL ORDER BY posts.id'
+    )
+
+
+def find_similar_content(conn, slug, content_hash, bands):
+    """Signed posts of other feeds with the same content hash or sharing a simhash band, oldest first"""
+    query = ('SELECT post_id, content_hash, media_hash, simhash, duplicate_of FROM post_content '
+             'WHERE feed != ? AND (content_hash = ?')
+    params = [slug, content_hash]
+    if bands:
+        for index, band in enumerate(bands):
+            query += f' OR band{index} = ?'
+            params.append(band)
+    return conn.execute(query + ') ORDER BY post_id', params)
+
+
+def get_post_content(conn, post_id):
+    """post_content row of a post with its pub_ts and GUID, or None"""
+    return conn.execute(
+        'SELECT post_content.*, posts.id, posts.pub_ts, posts.guid FROM post_content '
+        'JOIN posts ON posts.id = post_content.post_id WHERE post_id = ?', (post_id,)
+    ).fetchone()
+
+
+def add_post_content(conn, post_id, slug, content_hash, media_hash, simhash, bands, duplicate_of):
+    """Record a post's content address, sketch and the post it duplicates"""
+    conn.execute(
+        'INSERT OR REPLACE INTO post_content (post_id, feed, content_hash, media_hash, simhash, '
+        'band0, band1, band2, band3, duplicate_of) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        (post_id, slug, content_hash, media_hash, simhash, *(bands or (None,) * 4), duplicate_of)
+    )
+
+
+def set_original(conn, old_original, new_original):
+    """Point a post and every repost of it at a new original"""
+    conn.execute(
+        'UPDATE post_content SET duplicate_of = ? WHERE duplicate_of = ? OR post_id = ?',
+        (new_original, old_original, old_original)
+    )
+
+
+def clear_post_content(conn):
+    """Drop every post's signature so the next dedup pass signs them all again"""
+    conn.execute('DELETE FROM post_content')
+
+
+def get_duplicate_ids(conn, members=None, after_id=0):
+    """Ids of posts duplicating an earlier post, optionally only where both posts are in members"""
+    if members is None:
+        rows = conn.execute(
+            'SELECT post_id FROM post_content WHERE duplicate_of IS NOT NULL AND post_id > ?', (after_id,)
+        )
+        return {row['post_id'] for row in rows}
+
+    members = list(members)
+    placeholders = ', '.join('?' for _ in members)
+    rows = conn.execute(
+        'SELECT duplicate.post_id FROM post_content AS duplicate '
+        'JOIN post_content AS original ON original.post_id = duplicate.duplicate_of '
+        f'WHERE duplicate.post_id > ? AND duplicate.feed IN ({placeholders}) '
+        f'AND original.feed IN ({placeholders})',
+        (after_id, *members, *members)
+    )
+    return {row['post_id'] for row in rows}
+
+
+def get_dedup_stats(conn):
+    """Signed posts, how many are duplicates, and the description bytes those repeat"""
+    row = conn.execute(
+        'SELECT COUNT(*), COUNT(duplicate_of), '
+        'COALESCE(SUM(CASE WHEN duplicate_of IS NOT NULL THEN LENGTH(CAST(posts.description AS BLOB)) END), 0) '
+        'FROM post_content JOIN posts ON posts.id = post_content.post_id'
+    ).fetchone()
+    return {'posts': row[0], 'duplicates': row[1], 'duplicate_bytes': row[2]}
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+FBeed Run Stats
+Per-feed, per-stage timings of each run, kept as a short history in metadata/run-stats.json.
+"""
+
+import os
+import json
+import time
+import tempfile
+from contextlib import contextmanager
+
+RUN_STATS_PATH = 'metadata/run-stats.json'
+
+# Runs kept in the history file
+MAX_RUNS = 100
+
+# Stages of a feed in the order they happen
+STAGES = ('fetch', 'parse', 'load', 'merge', 'write')
+
+# Feeds listed as the slowest of a run
+SLOWEST_FEEDS = 5
+
+
+def new_feed_record(fetchrss_url):
+    """Empty stats record for one feed of a run"""
+    return {
+        'fetchrss_url': fetchrss_url,
+        'slug': None,
+        'outcome': None,
+        'stages': {},
+        'bytes_fetched': 0,
+        'bytes_written': 0,
+        'items_fetched': 0,
+        'items_added': 0,
+        'items_written': 0,
+    }
+
+
+@contextmanager
+def timed(record, stage):
+    """Add the time spent in the block to a stage of the record"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record['stages'][stage] = record['stages'].get(stage, 0.0) + time.perf_counter() - start
+
+
+def get_feed_seconds(record):
+    """Total time a feed spent in all stages"""
+    return sum(record['stages'].values())
+
+
+def summarise_run(started_at, duration, records):
+    """Build the history entry of a run from its feed records"""
+    feeds = []
+    for record in records:
+        feed = dict(record)
+        feed['stages'] = {stage: round(seconds, 4) for stage, seconds in record['stages'].items()}
+        feed['seconds'] = round(get_feed_seconds(record), 4)
+        feeds.append(feed)
+
+    stages = {
+        stage: round(sum(record['stages'].get(stage, 0.0) for record in records), 4)
+        for stage in STAGES
+    }
+    outcomes = {}
+    for record in records:
+        outcomes[record['outcome']] = outcomes.get(record['outcome'], 0) + 1
+
+    slowest = sorted(feeds, key=lambda feed: feed['seconds'], reverse=True)[:SLOWEST_FEEDS]
+    return {
+        'started_at': started_at,
+        'duration': round(duration, 4),
+        'stages': stages,
+        'outcomes': outcomes,
+        'bytes_fetched': sum(record['bytes_fetched'] for record in records),
+        'bytes_written': sum(record['bytes_written'] for record in records),
+        'items_fetched': sum(record['items_fetched'] for record in records),
+        'items_added': sum(record['items_added'] for record in records),
+        'slowest': [
+            {'slug': feed['slug'] or feed['fetchrss_url'], 'seconds': feed['seconds']}
+            for feed in slowest
+        ],
+        'feeds': feeds,
+    }
+
+
+def load_history(path=RUN_STATS_PATH):
+    """Load the run history, oldest run first"""
+    if not os.path.exists(path):
+        return {'runs': []}
+
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Error loading run stats {path}: {e}")
+        return {'runs': []}
+
+
+def get_latest_run(path=RUN_STATS_PATH):
+    """The most recent run in the history, or None"""
+    runs = load_history(path)['runs']
+    return runs[-1] if runs else None
+
+
+def append_run(run, path=RUN_STATS_PATH, max_runs=MAX_RUNS):
+    """Add a run to the history, dropping the oldest beyond max_runs, and save atomically"""
+    history = load_history(path)
+    history['runs'] = (history['runs'] + [run])[-max_runs:]
+
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix='.json')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(history, f, ensure_ascii=False, indent=2)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def format_stages(stages):
+    """One-line summary of per-stage seconds, e.g. 'fetch 3.20s · parse 0.41s'"""
+    return ' · '.join(f'{stage} {stages.get(stage, 0.0):.2f}s' for stage in STAGES)
+
+
+def print_summary(run):
+    """Print a run's per-stage totals and slowest feeds"""
+    print(f"\n⏱️  Run took {run['duration']:.2f}s ({format_stages(run['stages'])})")
+    for feed in run['slowest']:
+        print(f"   {feed['seconds']:>7.2f}s  {feed['slug']}")
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+FBeed Search Index
+Builds a static, sharded full-text index of all accumulated posts for the dashboard.
+"""
+
+import os
+import re
+import html
+import json
+import shutil
+import argparse
+import tempfile
+import unicodedata
+from datetime import datetime, timezone
+import post_store
+
+SEARCH_DIR = 'search'
+MANIFEST_PATH = f'{SEARCH_DIR}/manifest.json'
+
+# Changing either of these needs a --rebuild; the dashboard reads them from the manifest
+SHARD_COUNT = 64
+DOCS_PER_CHUNK = 1000
+
+# Longest title kept for a search result
+TITLE_LENGTH = 100
+
+# Han, kana and Hangul are indexed as overlapping character bigrams since
+# they aren't separated by spaces; everything else as whole words.
+# template.html tokenizes queries the same way.
+CJK_CHARS = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af'
+CJK_RUN = re.compile(f'[{CJK_CHARS}]+')
+TOKEN_PATTERN = re.compile(f'[{CJK_CHARS}]+|(?:(?![{CJK_CHARS}])[^\\W_])+')
+TAG_PATTERN = re.compile(r'<[^>]*>')
+
+
+def get_plain_text(markup):
+    """Text of a title or description without tags such as FetchRSS's <br /> and <img>"""
+    return html.unescape(TAG_PATTERN.sub(' ', markup or ''))
+
+
+def tokenize(text):
+    """Distinct search tokens of a text"""
+    tokens = set()
+    for match in TOKEN_PATTERN.finditer(unicodedata.normalize('NFKC', text).lower()):
+        run = match.group()
+        if CJK_RUN.match(run):
+            if len(run) == 1:
+                tokens.add(run)
+            tokens.update(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.add(run)
+    return tokens
+
+
+def get_shard(token, shard_count=SHARD_COUNT):
+    """Shard holding a token's postings: 32-bit FNV-1a over UTF-16 code units, as in JavaScript"""
+    value = 0x811c9dc5
+    data = token.encode('utf-16-le')
+    for i in range(0, len(data), 2):
+        value ^= data[i] | data[i + 1] << 8
+        value = (value * 0x01000193) & 0xffffffff
+    return value % shard_count
+
+
+def get_shard_path(shard):
+    return f'{SEARCH_DIR}/index/{shard}.json'
+
+
+def get_docs_path(chunk):
+    return f'{SEARCH_DIR}/docs/{chunk}.json'
+
+
+def load_json(path, default):
+    """Load a JSON file, or return default if it doesn't exist"""
+    if not os.path.exists(path):
+        return default
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_json(path, data):
+    """Write compact JSON to a temp file and atomically swap it into place"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix='.json')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def add_postings(deltas, ids):
+    """Append ascending ids to a postings list stored as gaps between ids"""
+    # Gaps are mostly a few digits where ids have five or six, which keeps
+    # the shards the browser downloads small
+    last_id = sum(deltas)
+    for post_id in ids:
+        deltas.append(post_id - last_id)
+        last_id = post_id
+
+
+def is_manifest_current(store, manifest):
+    """Whether the index can be extended, i.e. no indexed post was removed or re-imported"""
+    return (
+        manifest.get('version') == 2
+        and manifest.get('shards') == SHARD_COUNT
+        and manifest.get('docs_per_chunk') == DOCS_PER_CHUNK
+        and post_store.count_posts_up_to(store, manifest['last_post_id']) == manifest['indexed_posts']
+    )
+
+
+def get_search_doc(post, feed_titles):
+    """What a search result shows for a post"""
+    title = get_plain_text(post['title'] or post['description']).strip()
+    return {
+        't': title[:TITLE_LENGTH],
+        'u': post['link'],
+        'f': feed_titles.get(post['feed'], post['feed']),
+        's': post['feed'],
+        'd': int(post['pub_ts']),
+    }
+
+
+def update_index(store, rebuild=False):
+    """Index the posts added since the last build; return how many were indexed"""
+    manifest = load_json(MANIFEST_PATH, None)
+    if rebuild or not manifest or not is_manifest_current(store, manifest):
+        print("Building search index from scratch")
+        for name in ('index', 'docs'):
+            shutil.rmtree(f'{SEARCH_DIR}/{name}', ignore_errors=True)
+        manifest = {
+            'version': 2,
+            'shards': SHARD_COUNT,
+            'docs_per_chunk': DOCS_PER_CHUNK,
+            'last_post_id': 0,
+            'indexed_posts': 0,
+        }
+    
+    # Collect postings and docs of the new posts, grouped by the file they go to
+    feed_titles = post_store.get_feed_titles(store)
+    postings = {}
+    docs = {}
+    last_post_id = manifest['last_post_id']
+    count = 0
+    skipped = 0
+    # Reposts flagged by post_dedup.py are counted as seen but not indexed;
+    # searches find the original instead
+    reposts = post_store.get_duplicate_ids(store, after_id=last_post_id)
+    for post in post_store.iter_posts_after(store, last_post_id):
+        last_post_id = post['id']
+        count += 1
+        if post['id'] in reposts:
+            skipped += 1
+            continue
+        text = get_plain_text(post['title']) + ' ' + get_plain_text(post['description'])
+        for token in tokenize(text):
+            postings.setdefault(get_shard(token), {}).setdefault(token, []).append(post['id'])
+        docs.setdefault(post['id'] // DOCS_PER_CHUNK, {})[str(post['id'])] = get_search_doc(post, feed_titles)
+    
+    if not count:
+        print("Search index is up to date")
+        return 0
+    
+    # Only the shards and doc chunks the new posts touch are rewritten. Ids
+    # only grow, so appending keeps every postings list sorted.
+    for shard, shard_postings in postings.items():
+        path = get_shard_path(shard)
+        index = load_json(path, {})
+        for token, ids in shard_postings.items():
+            add_postings(index.setdefault(token, []), ids)
+        save_json(path, index)
+    
+    for chunk, chunk_docs in docs.items():
+        path = get_docs_path(chunk)
+        existing = load_json(path, {})
+        existing.update(chunk_docs)
+        save_json(path, existing)
+    
+    manifest['last_post_id'] = last_post_id
+    manifest['indexed_posts'] += count
+    manifest['skipped_reposts'] = manifest.get('skipped_reposts', 0) + skipped
+    manifest['updated'] = datetime.now(timezone.utc).isoformat()
+    save_json(MANIFEST_PATH, manifest)
+    
+    print(f"✅ Indexed {count - skipped} posts into {len(postings)} shards, skipped {skipped} reposts "
+          f"({manifest['indexed_posts']} total)")
+    return count
+
+
+def main():
+    """Main execution function"""
+    parser = argparse.ArgumentParser(description='FBeed - build the dashboard search index')
+    parser.add_argument('--rebuild', action='store_true', help='re-index every post from scratch')
+    args = parser.parse_args()
+    
+    print("FBeed - Updating search index...")
+    if not os.path.exists(post_store.STORE_PATH):
+        print(f"⚠️  No post store at {post_store.STORE_PATH}, run fbeed.py first")
+        return
+    
+    store = post_store.open_store()
+    try:
+        update_index(store, args.rebuild)
+    finally:
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,14 @@
+import os
+import subprocess
+import sys
+
+# The scripts live flat in the repository root
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+
+def run_script(workdir, script, *args):
+    """Run one of the repository's scripts in a work directory, failing the test if it fails"""
+    result = subprocess.run([sys.executable, os.path.join(REPO_DIR, script), *args],
+                            cwd=workdir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stdout[-2000:] + result.stderr[-2000:]
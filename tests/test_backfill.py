@@ -0,0 +1,90 @@
+"""Backfilling posts older than a feed's archives with add_feeds.py"""
+
+import os
+from email.utils import parsedate_to_datetime
+from xml.etree import ElementTree as ET
+
+import pytest
+import yaml
+
+import benchmark
+import fbeed
+import feed_pages
+from conftest import run_script
+
+# Upstream serves posts 80-199; the export holds the 50 posts before them
+UPSTREAM_ITEMS = 120
+NEWEST = 199
+EXPORT_ITEMS = 50
+HEAD_MAX_ITEMS = 40
+ARCHIVE_PAGE_SIZE = 20
+
+
+def read_page(path):
+    """Dates of a feed file's items and its prev-archive path"""
+    channel = ET.parse(path).getroot().find('channel')
+    dates = [parsedate_to_datetime(item.findtext('pubDate')) for item in channel.findall('item')]
+    links = [link.get('href') for link in channel.findall(fbeed.ATOM_LINK) if link.get('rel') == 'prev-archive']
+    return dates, links[0][len(fbeed.SITE_URL) + 1:] if links else None
+
+
+@pytest.fixture
+def workdir(tmp_path):
+    with benchmark.FetchRSSStandIn(0, 1, NEWEST + 1, UPSTREAM_ITEMS, 0) as stand_in:
+        benchmark.prepare_workdir(str(tmp_path), 0, stand_in, 1, 0)
+        with open(tmp_path / 'config.yaml', encoding='utf-8') as f:
+            config = yaml.safe_load(f)
+        config['settings'].update(head_max_items=HEAD_MAX_ITEMS, archive_page_size=ARCHIVE_PAGE_SIZE)
+        with open(tmp_path / 'config.yaml', 'w', encoding='utf-8') as f:
+            yaml.safe_dump(config, f, allow_unicode=True, sort_keys=False)
+        run_script(tmp_path, 'fbeed.py', '--all')
+
+        (tmp_path / 'export.xml').write_bytes(
+            benchmark.render_upstream_feed(0, 0, NEWEST - UPSTREAM_ITEMS, EXPORT_ITEMS))
+        (tmp_path / 'list.txt').write_text(f'{stand_in.get_feed_url(0)} export.xml\n', encoding='utf-8')
+        yield tmp_path
+
+
+def test_backfill_older_than_archives_extends_the_chain(workdir, monkeypatch):
+    slug = fbeed.generate_slug(benchmark.get_feed_title(0))
+    monkeypatch.chdir(workdir)
+    archived = {path: read_page(path)[0] for path in fbeed.list_archive_pages(slug)}
+
+    run_script(workdir, 'add_feeds.py', 'list.txt')
+
+    # The head keeps only posts newer than every archive page
+    head_dates, path = read_page(f'feeds/{slug}.xml')
+    assert len(head_dates) == HEAD_MAX_ITEMS
+    chain = []
+    newer = head_dates
+    while path:
+        dates, older_path = read_page(path)
+        assert max(dates) < min(newer)
+        chain.append(path)
+        newer = dates
+        path = older_path
+    assert chain[::-1] == fbeed.list_archive_pages(slug)
+    assert sum(len(read_page(page)[0]) for page in chain) == UPSTREAM_ITEMS - HEAD_MAX_ITEMS + EXPORT_ITEMS
+
+    # Pages already written keep their posts
+    for page, dates in archived.items():
+        assert read_page(page)[0] == dates
+
+
+def test_backfill_keeps_full_feed_pages_byte_identical(workdir, monkeypatch):
+    slug = fbeed.generate_slug(benchmark.get_feed_title(0))
+    monkeypatch.chdir(workdir)
+    run_script(workdir, 'feed_pages.py')
+    pages = sorted(os.listdir(f'view/{slug}'))
+    before = {name: (workdir / 'view' / slug / name).read_bytes() for name in pages}
+
+    run_script(workdir, 'add_feeds.py', 'list.txt')
+
+    # The backfilled posts are older than every page, but go on pages after the full ones
+    full_pages = [f'page-{page}.html' for page in range(1, UPSTREAM_ITEMS // feed_pages.PAGE_SIZE + 1)]
+    assert set(full_pages) < set(pages)
+    for name in full_pages:
+        assert (workdir / 'view' / slug / name).read_bytes() == before[name]
+    page_count = -(-(UPSTREAM_ITEMS + EXPORT_ITEMS) // feed_pages.PAGE_SIZE)
+    assert sorted(os.listdir(f'view/{slug}')) == sorted(
+        ['index.html'] + [f'page-{page}.html' for page in range(1, page_count + 1)])
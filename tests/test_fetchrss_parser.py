@@ -0,0 +1,112 @@
+"""Parity of the fast FetchRSS parser with feedparser"""
+
+import glob
+import os
+from xml.sax.saxutils import escape
+
+import feedparser
+import pytest
+
+import fetchrss_parser
+from conftest import REPO_DIR
+
+STORED_FEEDS = sorted(glob.glob(os.path.join(REPO_DIR, 'feeds', '**', '*.xml'), recursive=True))
+
+FOOTER = ('<br/><br/><span style="font-size: 12px; color: gray;">(Feed generated with '
+          '<a href="https://fetchrss.com" target="_blank">FetchRSS</a>)</span>')
+
+
+def make_item(title='貼文', link='https://www.facebook.com/page/posts/1', guid=None,
+              description='今日天氣很好<br />', creator='Page', extra=''):
+    """An <item> in FetchRSS's shape, with the description escaped as FetchRSS does"""
+    guid = guid or link
+    return (f'<item><title>{escape(title)}</title><link>{escape(link)}</link>'
+            f'<description>{escape(description + FOOTER.replace("<br/>", "<br />"))}</description>'
+            f'<dc:creator>{escape(creator)}</dc:creator><pubDate>Mon, 01 Jan 2024 00:00:00 GMT</pubDate>'
+            f'<guid>{escape(guid)}</guid>{extra}</item>')
+
+
+def make_feed(*items, declaration="<?xml version='1.0' encoding='utf-8'?>", root='version="2.0"'):
+    """A FetchRSS document around the given items"""
+    return (f'{declaration}<rss xmlns:dc="http://purl.org/dc/elements/1.1/" '
+            f'xmlns:media="http://search.yahoo.com/mrss/" {root}><channel>'
+            f'<title>Page on Facebook</title><description>專頁</description>'
+            f'<link>https://www.facebook.com/page</link>{"".join(items)}</channel></rss>').encode('utf-8')
+
+
+def assert_parity(content):
+    """The fast path either declines a document or returns what feedparser would"""
+    try:
+        parsed = fetchrss_parser.parse_fast(content)
+    except fetchrss_parser.NotFetchRSSShape:
+        return False
+    expected = fetchrss_parser.get_parity_fields(feedparser.parse(content))
+    assert fetchrss_parser.get_parity_fields(parsed) == expected
+    return True
+
+
+@pytest.mark.parametrize('path', STORED_FEEDS, ids=lambda path: os.path.relpath(path, REPO_DIR))
+def test_stored_feeds_match_feedparser(path):
+    with open(path, 'rb') as f:
+        content = f.read()
+    assert_parity(content)
+    # Whichever path a document takes, parse() gives the fields fbeed.py reads
+    assert (fetchrss_parser.get_parity_fields(fetchrss_parser.parse(content))
+            == fetchrss_parser.get_parity_fields(feedparser.parse(content)))
+
+
+def test_most_stored_feeds_take_the_fast_path():
+    if not STORED_FEEDS:
+        pytest.skip('no accumulated feeds')
+    fast = 0
+    for path in STORED_FEEDS:
+        with open(path, 'rb') as f:
+            fast += assert_parity(f.read())
+    assert fast >= len(STORED_FEEDS) * 0.75
+
+
+@pytest.mark.parametrize('content', [
+    make_feed(make_item()),
+    make_feed(make_item(extra='<media:content url="https://scontent.xx.fbcdn.net/v/a_n.jpg?oh=1&amp;oe=2" '
+                              'medium="image" />')),
+    make_feed(make_item(description='<img src="https://scontent.xx.fbcdn.net/a.jpg" /><br />圖片')),
+    make_feed(make_item(title='Tom &amp; Jerry', description='A &amp; B')),
+    make_feed(make_item(), make_item(link='https://www.facebook.com/page/posts/2')),
+    make_feed(),
+], ids=['plain', 'media', 'image markup', 'ampersands', 'two items', 'no items'])
+def test_fetchrss_shape_takes_the_fast_path(content):
+    assert assert_parity(content)
+
+
+@pytest.mark.parametrize('content', [
+    # Other formats and encodings
+    b'<?xml version="1.0"?><feed xmlns="http://www.w3.org/2005/Atom"><title>A</title></feed>',
+    make_feed(make_item(), root='version="0.91"'),
+    make_feed(make_item(), declaration='<?xml version="1.0" encoding="big5"?>'),
+    # Malformed documents
+    make_feed(make_item())[:-40],
+    make_feed(make_item()).replace(b'</title>', b'</titel>', 1),
+    b'',
+    # Markup and text feedparser rewrites
+    make_feed(make_item(description='愛你 <3 <script>alert(1)</script>')),
+    make_feed(make_item(description='<回報客人>')),
+    make_feed(make_item(description='&copy; 2024')),
+    make_feed(make_item(title='<b>粗體</b>')),
+    make_feed(make_item(title='cafÃ©')),
+    make_feed(make_item(title='control \x85 char')),
+    make_feed(make_item(creator='page@example.com (Page)')),
+    make_feed(make_item(link='/posts/1')),
+    make_feed(make_item(link='https://www.facebook.com/?a=1&amp;amp;b=2')),
+    # Elements FetchRSS never sends
+    make_feed(make_item(extra='<category>news</category>')),
+    make_feed(make_item(extra='<media:content url="https://example.com/a.jpg" width="10" />')),
+    make_feed(make_item(extra='<media:content url="a.jpg" />')),
+    make_feed(make_item(guid='', link='')),
+], ids=['atom', 'rss 0.91', 'big5', 'truncated', 'mismatched tag', 'empty',
+        'script', 'bracketed text', 'entity', 'title markup', 'latin-1', 'c1 control', 'author e-mail',
+        'relative link', 'link entity', 'category', 'media attribute', 'relative media', 'no guid or link'])
+def test_other_documents_fall_back_to_feedparser(content):
+    with pytest.raises(fetchrss_parser.NotFetchRSSShape):
+        fetchrss_parser.parse_fast(content)
+    assert (fetchrss_parser.get_parity_fields(fetchrss_parser.parse(content))
+            == fetchrss_parser.get_parity_fields(feedparser.parse(content)))
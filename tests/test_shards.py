@@ -0,0 +1,86 @@
+"""Handover of a sharded run's files to the merge job, as the workflow does it"""
+
+import json
+import os
+import shutil
+import sqlite3
+from xml.etree import ElementTree as ET
+
+import pytest
+import yaml
+
+import benchmark
+import fbeed
+from conftest import run_script
+
+FEED_COUNT = 6
+ITEM_COUNT = 30
+SHARDS = 3
+
+
+def count_items(path):
+    return len(ET.parse(path).getroot().findall('channel/item'))
+
+
+@pytest.fixture
+def stand_in():
+    with benchmark.FetchRSSStandIn(0, FEED_COUNT, ITEM_COUNT, 20, 5) as stand_in:
+        yield stand_in
+
+
+def test_merge_on_a_fresh_checkout_imports_every_feed(stand_in, tmp_path):
+    # The committed tree: feeds and their status, but no post store yet
+    checkout = tmp_path / 'checkout'
+    checkout.mkdir()
+    benchmark.prepare_workdir(str(checkout), 0, stand_in, FEED_COUNT, ITEM_COUNT)
+    run_script(checkout, 'fbeed.py', '--all')
+    os.remove(checkout / 'metadata' / 'posts.db')
+
+    # Upstream has nothing new, so no shard hands over a changed feed
+    for index in range(1, SHARDS + 1):
+        shard_dir = tmp_path / f'shard-{index}'
+        shutil.copytree(checkout, shard_dir)
+        run_script(shard_dir, 'fbeed.py', '--all', '--shard', f'{index}/{SHARDS}')
+        name = f'feed-status-{index}-of-{SHARDS}.json'
+        with open(shard_dir / 'metadata' / 'shards' / name, encoding='utf-8') as f:
+            assert json.load(f)['changed_slugs'] == []
+        (checkout / 'metadata' / 'shards').mkdir(exist_ok=True)
+        shutil.copy(shard_dir / 'metadata' / 'shards' / name, checkout / 'metadata' / 'shards' / name)
+
+    run_script(checkout, 'fbeed.py', '--merge-shards')
+
+    with open(checkout / 'metadata' / 'feed-status.json', encoding='utf-8') as f:
+        feeds = json.load(f)['feeds']
+    conn = sqlite3.connect(checkout / 'metadata' / 'posts.db')
+    stored = dict(conn.execute('SELECT feed, COUNT(*) FROM posts GROUP BY feed'))
+    conn.close()
+    assert len(feeds) == FEED_COUNT
+    assert stored == {feed['slug']: ITEM_COUNT for feed in feeds}
+    assert count_items(checkout / 'feeds' / 'aggregate' / 'all.xml') > 0
+
+
+def test_new_feeds_with_the_same_title_in_different_shards_get_their_own_slugs(stand_in, tmp_path):
+    benchmark.prepare_workdir(str(tmp_path), 0, stand_in, FEED_COUNT, ITEM_COUNT)
+    run_script(tmp_path, 'fbeed.py', '--all')
+
+    # The stand-in serves a feed under any directory, so these two share a title
+    for index in range(FEED_COUNT, FEED_COUNT + 100):
+        urls = [stand_in.get_feed_url(index), stand_in.get_feed_url(index).replace('/feed/', '/mirror/')]
+        if fbeed.get_feed_shard(urls[0], SHARDS) != fbeed.get_feed_shard(urls[1], SHARDS):
+            break
+    with open(tmp_path / 'config.yaml', encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+    config['feeds'] += [{'fetchrss_url': url} for url in urls]
+    with open(tmp_path / 'config.yaml', 'w', encoding='utf-8') as f:
+        yaml.safe_dump(config, f, allow_unicode=True, sort_keys=False)
+
+    for index in range(1, SHARDS + 1):
+        run_script(tmp_path, 'fbeed.py', '--shard', f'{index}/{SHARDS}')
+    run_script(tmp_path, 'fbeed.py', '--merge-shards')
+
+    with open(tmp_path / 'metadata' / 'feed-status.json', encoding='utf-8') as f:
+        feeds = json.load(f)['feeds']
+    slugs = [feed['slug'] for url in urls for feed in feeds if feed['fetchrss_url'] == url]
+    assert len(set(slugs)) == 2
+    for slug in slugs:
+        assert count_items(tmp_path / 'feeds' / f'{slug}.xml') == 20
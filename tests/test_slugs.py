@@ -0,0 +1,26 @@
+"""Slugs of feeds whose titles collide"""
+
+import hashlib
+
+import fbeed
+
+TITLE = 'Same Page on Facebook'
+SLUG = fbeed.generate_slug(TITLE)
+
+
+def get_suffixed(url):
+    return f'{SLUG}-{hashlib.sha256(url.encode("utf-8")).hexdigest()[:6]}'
+
+
+def test_stored_feed_keeps_its_slug_whatever_the_urls():
+    # The new feed sorts first, but the slug is already in use
+    assert fbeed.resolve_slug('https://a.example/feed', TITLE, {'https://b.example/feed': SLUG}) \
+        == get_suffixed('https://a.example/feed')
+    assert fbeed.resolve_slug('https://b.example/feed', TITLE, {'https://b.example/feed': SLUG}) == SLUG
+    assert fbeed.resolve_slug('https://b.example/feed', TITLE, {}) == SLUG
+
+
+def test_feeds_already_sharing_a_slug_are_split_by_url():
+    slugs = {'https://a.example/feed': SLUG, 'https://b.example/feed': SLUG}
+    assert fbeed.resolve_slug('https://a.example/feed', TITLE, slugs) == SLUG
+    assert fbeed.resolve_slug('https://b.example/feed', TITLE, slugs) == get_suffixed('https://b.example/feed')